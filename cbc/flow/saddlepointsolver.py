@@ -215,7 +215,7 @@ class TaylorHoodSolver(CBCSolver):
 
         return self.u1, self.p1
 
-    def reassemble(self):
+    def reassemble(self, lazy=False):
         "Reassemble matrices, needed when mesh or time step has changed"
         info("(Re)assembling matrices")
         info("No action taken here in this solver")
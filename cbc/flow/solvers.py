@@ -87,8 +87,7 @@ class NavierStokesSolver(CBCSolver):
 
         # Tentative velocity step (sigma formulation)
         U = 0.5*(u0 + u)
-        F1 = rho*(1/k)*inner(v, u - u0)*dx \
-            + rho*inner(v, grad(u0)*(u0 - w))*dx \
+        F1_k = rho*inner(v, grad(u0)*(u0 - w))*dx \
             + inner(epsilon(v), sigma(U, p0))*dx \
             - inner(v, g)*ds \
             - inner(v, f)*dx \
@@ -99,14 +98,22 @@ class NavierStokesSolver(CBCSolver):
 ##                    + inner(v, p0*n)*ds \
 ##            - mu*inner(grad(U).T*n, v)*ds
 ##            have been added i again.
+        F1 = rho*(1/k)*inner(v, u - u0)*dx + F1_k
 
         a1 = lhs(F1)
         L1 = rhs(F1)
 
+        # Split tentative velocity matrix: A1 = (1/k)*M1 + K1
+        m1 = rho*inner(v, u)*dx
+        k1 = lhs(F1_k)
+
         # Pressure correction
         a2 = inner(grad(q), k*grad(p))*dx
         L2 = inner(grad(q), k*grad(p0))*dx - q*rho*div(u1)*dx
 
+        # Split pressure matrix: A2 = k*S2
+        s2 = inner(grad(q), grad(p))*dx
+
         # Add alternative using proper constraint
         QR = Q*R
         q_r, s_r = TestFunctions(QR)
@@ -116,6 +123,10 @@ class NavierStokesSolver(CBCSolver):
         a2_r = inner(grad(q_r), k*grad(p_r))*dx + r_r*q_r*dx + p_r*s_r*dx
         L2_r = inner(grad(q_r), k*grad(p0))*dx - q_r*rho*div(u1)*dx
 
+        # Split constrained pressure matrix: A2_r = k*S2_r + C2_r
+        s2_r = inner(grad(q_r), grad(p_r))*dx
+        c2_r = r_r*q_r*dx + p_r*s_r*dx
+
         # Velocity correction
         a3 = inner(v, rho*u)*dx
         L3 = inner(v, rho*u1)*dx + inner(v, k*grad(p0 - p1))*dx
@@ -150,6 +161,11 @@ class NavierStokesSolver(CBCSolver):
         self.a2 = a2
         self.a2_r = a2_r
         self.a3 = a3
+        self.m1 = m1
+        self.k1 = k1
+        self.s2 = s2
+        self.s2_r = s2_r
+        self.c2_r = c2_r
         self.solver1 = solver1
         self.solver2 = solver2
         self.solver3 = solver3
@@ -160,8 +176,13 @@ class NavierStokesSolver(CBCSolver):
         self.velocity_series = None
         self.pressure_series = None
 
-        # Assemble matrices
-        self.reassemble()
+        # Assembled parts of pressure matrices
+        self.S2 = None
+        self.S2_r = None
+
+        # Assemble matrices (postponed until the first step when the
+        # solver parameters are known)
+        self.reassemble(lazy=True)
 
     def solve(self):
         "Solve problem and return computed solution (u, p)"
@@ -181,11 +202,14 @@ class NavierStokesSolver(CBCSolver):
     def step(self, dt):
         "Compute solution for new time step"
 
-        # Check if we need to reassemble
+        # Check if we need to reassemble (or just update the time step)
         if not dt == self.dt:
             info("Using actual timestep: %g" % dt)
             self.dt = dt
             self.k.assign(dt)
+            if not self._reassemble:
+                self._update_matrices()
+        if self._reassemble or not self._has_pressure_matrix():
             self.reassemble()
 
         # Compute tentative velocity step
@@ -259,17 +283,53 @@ class NavierStokesSolver(CBCSolver):
 
         return self.u1, self.p1
 
-    def reassemble(self):
-        "Reassemble matrices, needed when mesh or time step has changed"
+    def reassemble(self, lazy=False):
+        """Reassemble matrices, needed when mesh or time step has changed.
+        If lazy is True, reassembly is postponed until the next step.
+        All matrices are integrated over the (moving) mesh, so a mesh
+        update always requires full reassembly; postponing it only
+        avoids assembling for mesh updates that are not followed by a
+        step."""
+
+        # Just mark matrices as out of date
+        if lazy:
+            self._reassemble = True
+            return
+
+        # Assemble time step independent parts of the matrices (only the
+        # pressure matrix used by the solver)
         info("(Re)assembling matrices")
-        self.A1 = assemble(self.a1)
-        self.A2 = assemble(self.a2)
-        self.A2_r = assemble(self.a2_r)
+        self.M1 = assemble(self.m1)
+        self.K1 = assemble(self.k1)
+        if self.parameters["zero_average_pressure"]:
+            self.S2_r = assemble(self.s2_r)
+            self.C2_r = assemble(self.c2_r)
+            self.S2 = None
+        else:
+            self.S2 = assemble(self.s2)
+            self.S2_r = None
         self.A3 = assemble(self.a3)
-        self.b1 = assemble(self.L1)
-        self.b2 = assemble(self.L2)
-        self.b2_r = assemble(self.L2_r)
-        self.b3 = assemble(self.L3)
+        self._reassemble = False
+
+        # Compute matrices for current time step
+        self._update_matrices()
+
+    def _update_matrices(self):
+        "Compute matrices for current time step from assembled parts"
+        self.A1 = self.K1.copy()
+        self.A1.axpy(1.0 / self.dt, self.M1, True)
+        if self.S2 is not None:
+            self.A2 = self.S2.copy()
+            self.A2 *= self.dt
+        if self.S2_r is not None:
+            self.A2_r = self.C2_r.copy()
+            self.A2_r.axpy(self.dt, self.S2_r, True)
+
+    def _has_pressure_matrix(self):
+        "Check whether the pressure matrix used by the solver is assembled"
+        if self.parameters["zero_average_pressure"]:
+            return self.S2_r is not None
+        return self.S2 is not None
 
     def solution(self):
         "Return current solution values"
@@ -7,15 +7,19 @@ __license__  = "GNU GPL Version 3 or any later version"
 
 # Last changed: 2012-05-04
 
-from dolfin import info
+from dolfin import info, MPI
+from dolfin.compilemodules.jit import jit
 from numpy import zeros, ones, argsort, linalg, dot
 import numpy
+import multiprocessing
 
 from residuals import *
 from storage import *
 from spaces import *
 from utils import *
+from cbc.swing.fsinewton.utils.timings import timings
 from sys import exit
+from time import time as python_time
 
 # Variables for time residual
 U0 = U1 = M = W = w = TOL_k = None
@@ -40,8 +44,8 @@ def estimate_error(problem, parameters):
     dg = TestFunction(DG)
 
     # Create time series
-    primal_series = create_primal_series(parameters)
-    dual_series = create_dual_series(parameters)
+    primal_series = create_primal_series(parameters, _refinement_level)
+    dual_series = create_dual_series(parameters, _refinement_level)
 
     # Create primal functions
     U0 = create_primal_functions(Omega, parameters)
@@ -103,200 +107,282 @@ def estimate_error(problem, parameters):
     # Get weak residuals for E_c
     Rc_F, Rc_S, Rc_M = weak_residuals(UU0, UU1, UU, Z, kn, problem)
 
-    # Reset vectors for assembly of residuals
-    eta_F = None
-    eta_S = None
-    eta_M = None
-
-    # Reset variables
-    E_0_F = 0.0
-    E_0_S = 0.0
-    E_0_M = 0.0
-    E_k   = 0.0
-    E_c   = 0.0
-    E_c_F = 0.0
-    E_c_S = 0.0
-    E_c_M = 0.0
-
-    # Sum residuals over time intervals
-    timestep_range = read_timestep_range(problem.end_time(), primal_series)
-    for i in range(1, len(timestep_range)):
-
-        # Get current time and time step
-        t0 = timestep_range[i - 1]
-        t1 = timestep_range[i]
-        tmid = 0.5*(t0 + t1)         # MER: Get midtime for body forces
-        T  = problem.end_time()
-        dt = t1 - t0
-        kn.assign(dt)
-
-        # Display progress
-        info("")
-        info("-"*80)
-        begin("* Evaluating residuals on new time step")
-        info_blue("* t = %g (T = %g, dt = %g)" % (t0, T, dt))
-
-        # Update primal solution
-        if parameters["use_exact_solution"]:
-            u0.t = t0
-            u1.t = t1
-        else:
-            read_primal_data(U0, t0, Omega, Omega_F, Omega_S, primal_series, parameters)
-            read_primal_data(U1, t1, Omega, Omega_F, Omega_S, primal_series, parameters)
-
-        # Read dual data
-        read_dual_data(ZZ0, t0, dual_series)
-        read_dual_data(ZZ1, t1, dual_series)
-
-        # Extrapolate dual data
-        info_green("Extrapolatin'")
-        [EZ0[j].extrapolate(Z0[j]) for j in range(num_fields)]
-        [EZ1[j].extrapolate(Z1[j]) for j in range(num_fields)]
-
-        # Apply dual boundary conditions to extrapolation
-        [apply_bc(EZ0[j], Z0[j]) for j in range(num_fields)]
-        [apply_bc(EZ1[j], Z1[j]) for j in range(num_fields)]
-
-        # Assemble weak residuals for error representation
-        e0_F = [assemble(r0, mesh=Omega,
-                         cell_domains=problem.cell_domains,
-                         exterior_facet_domains=problem.fsi_boundary,
-                         interior_facet_domains=problem.fsi_boundary)
-                for r0 in [R0_F0, R0_F1, R0_F]]
-
-        e0_S = []
-        if mer_debugging:
-            # Update sources for structure residuals
-            B = problem.structure_body_force()
-            G_0 = problem.structure_boundary_traction_extra()
-
-            B.t = t0
-            G_0.t = t0
-            value = assemble(R0_S0, mesh=Omega,
-                             cell_domains=problem.cell_domains,
-                             exterior_facet_domains=problem.fsi_boundary,
-                             interior_facet_domains=problem.fsi_boundary)
-            e0_S += [value]
-
-            B.t = t1
-            G_0.t = t1
-            value = assemble(R0_S1, mesh=Omega,
-                             cell_domains=problem.cell_domains,
-                             exterior_facet_domains=problem.fsi_boundary,
-                             interior_facet_domains=problem.fsi_boundary)
-            e0_S += [value]
-
-            B.t = tmid
-            G_0.t = tmid
-            value = assemble(R0_S, mesh=Omega,
-                             cell_domains=problem.cell_domains,
-                             exterior_facet_domains=problem.fsi_boundary,
-                             interior_facet_domains=problem.fsi_boundary)
-            e0_S += [value]
+    # Combine residuals into a single form (all but e0_S which
+    # depends on the time of the structure sources)
+    fused_assembly = parameters["fused_assembly"]
+    if fused_assembly:
+        scalar_residuals = [R0_F0, R0_F1, R0_F, R0_M0, R0_M1, R0_M,
+                            Rk0_F + Rk0_S + Rk0_M, Rk1_F + Rk1_S + Rk1_M,
+                            Rc_F, Rc_S, Rc_M]
+        indicator_residuals = list(Rh_F) + list(Rh_S) + list(Rh_M)
+        R_fused = fused_residuals(Omega, scalar_residuals, indicator_residuals, dg)
 
-        else:
-            B = problem.structure_body_force()
-            B.t = 0.0
-            e0_S = [assemble(r0, mesh=Omega,
-                             cell_domains=problem.cell_domains,
-                             exterior_facet_domains=problem.fsi_boundary,
-                             interior_facet_domains=problem.fsi_boundary)
-                    for r0 in [R0_S0, R0_S1, R0_S]]
-
-        if mer_debugging:
-            F_M = problem.mesh_right_hand_side()
-            F_M.t = tmid
-        else:
-            F_M = problem.mesh_right_hand_side()
-            F_M.t = 0
-        e0_M = [assemble(r0, mesh=Omega,
-                         cell_domains=problem.cell_domains,
-                         exterior_facet_domains=problem.fsi_boundary,
-                         interior_facet_domains=problem.fsi_boundary)
-                for r0 in [R0_M0, R0_M1, R0_M]]
-
-        print "(t0, t1) = ", (t0, t1)
-        print "e_0_F = %r" % e0_F
-        print "e_0_S = %r" % e0_S
-        print "e_0_M = %r" % e0_M
-
-        # Assemble strong residuals for space discretization error
-        info("Assembling error contributions")
-        e_F = [assemble(Rh_Fi,
-                        cell_domains=problem.cell_domains,
-                        exterior_facet_domains=problem.fsi_boundary,
-                        interior_facet_domains=problem.fsi_boundary)
-               for Rh_Fi in Rh_F]
-        e_S = [assemble(Rh_Si,
-                        cell_domains=problem.cell_domains,
-                        exterior_facet_domains=problem.fsi_boundary,
-                        interior_facet_domains=problem.fsi_boundary)
-               for Rh_Si in Rh_S]
-        e_M = [assemble(Rh_Mi,
-                        cell_domains=problem.cell_domains,
-                        exterior_facet_domains=problem.fsi_boundary,
-                        interior_facet_domains=problem.fsi_boundary)
-               for Rh_Mi in Rh_M]
-
-        # Assemble weak residual for time discretization error (error estimate)
-        Rk0 = assemble(Rk0_F + Rk0_S + Rk0_M,
-                       cell_domains=problem.cell_domains,
-                       exterior_facet_domains=problem.fsi_boundary,
-                       interior_facet_domains=problem.fsi_boundary)
-        Rk1 = assemble(Rk1_F + Rk1_S + Rk1_M,
-                       cell_domains=problem.cell_domains,
-                       exterior_facet_domains=problem.fsi_boundary,
-                       interior_facet_domains=problem.fsi_boundary)
-        Rk = 0.5 * abs(Rk1 - Rk0) / dt
-
-        # Assemble weak residuals for computational error
-        RcF = assemble(Rc_F, mesh=Omega,
-                       cell_domains=problem.cell_domains,
-                       exterior_facet_domains=problem.fsi_boundary,
-                       interior_facet_domains=problem.fsi_boundary)
-        RcS = assemble(Rc_S, mesh=Omega,
-                       cell_domains=problem.cell_domains,
-                       exterior_facet_domains=problem.fsi_boundary,
-                       interior_facet_domains=problem.fsi_boundary)
-        RcM = assemble(Rc_M, mesh=Omega,
-                       cell_domains=problem.cell_domains,
-                       exterior_facet_domains=problem.fsi_boundary,
-                       interior_facet_domains=problem.fsi_boundary)
+    def estimate_intervals(intervals):
+        "Sum residuals over given (consecutive) time intervals"
 
         # Reset vectors for assembly of residuals
-        if eta_F is None:
-            eta_F = [zeros(Omega.num_cells()) for i in range(len(e_F))]
-        if eta_S is None:
-            eta_S = [zeros(Omega.num_cells()) for i in range(len(e_S))]
-        if eta_M is None:
-            eta_M = [zeros(Omega.num_cells()) for i in range(len(e_M))]
-
-        # Add to error indicators
-        for i in range(len(e_F)):
-            eta_F[i] += dt * abs(e_F[i].array())
-        for i in range(len(e_S)):
-            eta_S[i] += dt * abs(e_S[i].array())
-        for i in range(len(e_M)):
-            eta_M[i] += dt * abs(e_M[i].array())
-
-        # Add to E_0 (3-point Lobatto quadrature)
-        E_0_F += dt * numpy.dot(e0_F, [1.0/6.0, 1.0/6.0, 2.0/3.0])
-        if mer_debugging:
-            E_0_S += dt*e0_S[-1]
+        eta_F = None
+        eta_S = None
+        eta_M = None
+
+        # Reset variables
+        E_0_F = 0.0
+        E_0_S = 0.0
+        E_0_M = 0.0
+        E_k   = 0.0
+        E_c   = 0.0
+        E_c_F = 0.0
+        E_c_S = 0.0
+        E_c_M = 0.0
+
+        # Reset tensor for fused assembly
+        r_fused = None
+
+        # Read primal data in the background
+        prefetcher = None
+        if not parameters["use_exact_solution"]:
+            times = timestep_range[intervals[0] - 1:intervals[-1] + 1]
+            prefetcher = create_prefetcher(times, primal_series, parameters)
+        for i in intervals:
+
+            # Get current time and time step
+            t0 = timestep_range[i - 1]
+            t1 = timestep_range[i]
+            tmid = 0.5*(t0 + t1)         # MER: Get midtime for body forces
+            T  = problem.end_time()
+            dt = t1 - t0
+            kn.assign(dt)
+
+            # Display progress
+            info("")
+            info("-"*80)
+            begin("* Evaluating residuals on new time step")
+            info_blue("* t = %g (T = %g, dt = %g)" % (t0, T, dt))
+
+            # Update primal solution
+            if parameters["use_exact_solution"]:
+                u0.t = t0
+                u1.t = t1
+            elif i == intervals[0]:
+                read_primal_data(U0, t0, Omega, Omega_F, Omega_S, primal_series, parameters,
+                                 prefetcher)
+                read_primal_data(U1, t1, Omega, Omega_F, Omega_S, primal_series, parameters,
+                                 prefetcher)
+            else:
+                # Data at t0 was read as t1 in the previous step
+                copy_primal_data(U0, U1)
+                read_primal_data(U1, t1, Omega, Omega_F, Omega_S, primal_series, parameters,
+                                 prefetcher)
+
+            # Read dual data (reuse data at t0 from previous step)
+            if i == intervals[0]:
+                read_dual_data(ZZ0, t0, dual_series)
+            else:
+                ZZ0.assign(ZZ1)
+            read_dual_data(ZZ1, t1, dual_series)
+
+            # Extrapolate dual data
+            info_green("Extrapolatin'")
+            [EZ0[j].extrapolate(Z0[j]) for j in range(num_fields)]
+            [EZ1[j].extrapolate(Z1[j]) for j in range(num_fields)]
+
+            # Apply dual boundary conditions to extrapolation
+            [apply_bc(EZ0[j], Z0[j]) for j in range(num_fields)]
+            [apply_bc(EZ1[j], Z1[j]) for j in range(num_fields)]
+
+            # Assemble weak residuals for error representation
+            if not fused_assembly:
+                e0_F = [assemble(r0, mesh=Omega,
+                                 cell_domains=problem.cell_domains,
+                                 exterior_facet_domains=problem.fsi_boundary,
+                                 interior_facet_domains=problem.fsi_boundary)
+                        for r0 in [R0_F0, R0_F1, R0_F]]
+
+            e0_S = []
+            if mer_debugging:
+                # Update sources for structure residuals
+                B = problem.structure_body_force()
+                G_0 = problem.structure_boundary_traction_extra()
+
+                B.t = t0
+                G_0.t = t0
+                value = assemble(R0_S0, mesh=Omega,
+                                 cell_domains=problem.cell_domains,
+                                 exterior_facet_domains=problem.fsi_boundary,
+                                 interior_facet_domains=problem.fsi_boundary)
+                e0_S += [value]
+
+                B.t = t1
+                G_0.t = t1
+                value = assemble(R0_S1, mesh=Omega,
+                                 cell_domains=problem.cell_domains,
+                                 exterior_facet_domains=problem.fsi_boundary,
+                                 interior_facet_domains=problem.fsi_boundary)
+                e0_S += [value]
+
+                B.t = tmid
+                G_0.t = tmid
+                value = assemble(R0_S, mesh=Omega,
+                                 cell_domains=problem.cell_domains,
+                                 exterior_facet_domains=problem.fsi_boundary,
+                                 interior_facet_domains=problem.fsi_boundary)
+                e0_S += [value]
+
+            else:
+                B = problem.structure_body_force()
+                B.t = 0.0
+                e0_S = [assemble(r0, mesh=Omega,
+                                 cell_domains=problem.cell_domains,
+                                 exterior_facet_domains=problem.fsi_boundary,
+                                 interior_facet_domains=problem.fsi_boundary)
+                        for r0 in [R0_S0, R0_S1, R0_S]]
+
+            if mer_debugging:
+                F_M = problem.mesh_right_hand_side()
+                F_M.t = tmid
+            else:
+                F_M = problem.mesh_right_hand_side()
+                F_M.t = 0
+            if fused_assembly:
+
+                # Assemble all residuals in one pass over the mesh
+                info("Assembling error contributions")
+                r_fused = assemble(R_fused, tensor=r_fused,
+                                   cell_domains=problem.cell_domains,
+                                   exterior_facet_domains=problem.fsi_boundary,
+                                   interior_facet_domains=problem.fsi_boundary)
+                values = r_fused.array()
+                n = len(scalar_residuals)
+                e0_F = list(values[0:3])
+                e0_M = list(values[3:6])
+                Rk0, Rk1, RcF, RcS, RcM = values[6:n]
+
+                # Extract error indicators (one row per residual)
+                e = values[n:].reshape((len(indicator_residuals), Omega.num_cells()))
+                e_F = e[:len(Rh_F)]
+                e_S = e[len(Rh_F):len(Rh_F) + len(Rh_S)]
+                e_M = e[len(Rh_F) + len(Rh_S):]
+
+            else:
+                e0_M = [assemble(r0, mesh=Omega,
+                                 cell_domains=problem.cell_domains,
+                                 exterior_facet_domains=problem.fsi_boundary,
+                                 interior_facet_domains=problem.fsi_boundary)
+                        for r0 in [R0_M0, R0_M1, R0_M]]
+
+            print "(t0, t1) = ", (t0, t1)
+            print "e_0_F = %r" % e0_F
+            print "e_0_S = %r" % e0_S
+            print "e_0_M = %r" % e0_M
+
+            if not fused_assembly:
+                # Assemble strong residuals for space discretization error
+                info("Assembling error contributions")
+                e_F = [assemble(Rh_Fi,
+                                cell_domains=problem.cell_domains,
+                                exterior_facet_domains=problem.fsi_boundary,
+                                interior_facet_domains=problem.fsi_boundary).array()
+                       for Rh_Fi in Rh_F]
+                e_S = [assemble(Rh_Si,
+                                cell_domains=problem.cell_domains,
+                                exterior_facet_domains=problem.fsi_boundary,
+                                interior_facet_domains=problem.fsi_boundary).array()
+                       for Rh_Si in Rh_S]
+                e_M = [assemble(Rh_Mi,
+                                cell_domains=problem.cell_domains,
+                                exterior_facet_domains=problem.fsi_boundary,
+                                interior_facet_domains=problem.fsi_boundary).array()
+                       for Rh_Mi in Rh_M]
+
+                # Assemble weak residual for time discretization error (error estimate)
+                Rk0 = assemble(Rk0_F + Rk0_S + Rk0_M,
+                               cell_domains=problem.cell_domains,
+                               exterior_facet_domains=problem.fsi_boundary,
+                               interior_facet_domains=problem.fsi_boundary)
+                Rk1 = assemble(Rk1_F + Rk1_S + Rk1_M,
+                               cell_domains=problem.cell_domains,
+                               exterior_facet_domains=problem.fsi_boundary,
+                               interior_facet_domains=problem.fsi_boundary)
+            Rk = 0.5 * abs(Rk1 - Rk0) / dt
+
+            # Assemble weak residuals for computational error
+            if not fused_assembly:
+                RcF = assemble(Rc_F, mesh=Omega,
+                               cell_domains=problem.cell_domains,
+                               exterior_facet_domains=problem.fsi_boundary,
+                               interior_facet_domains=problem.fsi_boundary)
+                RcS = assemble(Rc_S, mesh=Omega,
+                               cell_domains=problem.cell_domains,
+                               exterior_facet_domains=problem.fsi_boundary,
+                               interior_facet_domains=problem.fsi_boundary)
+                RcM = assemble(Rc_M, mesh=Omega,
+                               cell_domains=problem.cell_domains,
+                               exterior_facet_domains=problem.fsi_boundary,
+                               interior_facet_domains=problem.fsi_boundary)
+
+            # Reset vectors for assembly of residuals
+            if eta_F is None:
+                eta_F = [zeros(Omega.num_cells()) for k in range(len(e_F))]
+            if eta_S is None:
+                eta_S = [zeros(Omega.num_cells()) for k in range(len(e_S))]
+            if eta_M is None:
+                eta_M = [zeros(Omega.num_cells()) for k in range(len(e_M))]
+
+            # Add to error indicators
+            for k in range(len(e_F)):
+                eta_F[k] += dt * abs(e_F[k])
+            for k in range(len(e_S)):
+                eta_S[k] += dt * abs(e_S[k])
+            for k in range(len(e_M)):
+                eta_M[k] += dt * abs(e_M[k])
+
+            # Add to E_0 (3-point Lobatto quadrature)
+            E_0_F += dt * numpy.dot(e0_F, [1.0/6.0, 1.0/6.0, 2.0/3.0])
+            if mer_debugging:
+                E_0_S += dt*e0_S[-1]
+            else:
+                E_0_S += dt * numpy.dot(e0_S, [1.0/6.0, 1.0/6.0, 2.0/3.0])
+
+            E_0_M += dt * numpy.dot(e0_M, [1.0/6.0, 1.0/6.0, 2.0/3.0])
+
+            # Add to E_k
+            E_k += dt * dt * Rk
+
+            # Add to E_c's
+            E_c_F += dt * RcF
+            E_c_S += dt * RcS
+            E_c_M += dt * RcM
+
+            end()
+
+        # Stop background reading
+        if prefetcher is not None:
+            prefetcher.close()
+
+        return E_0_F, E_0_S, E_0_M, E_k, E_c_F, E_c_S, E_c_M, eta_F, eta_S, eta_M
+
+    # Sum residuals over time intervals (in parallel if requested)
+    timestep_range = read_timestep_range(problem.end_time(), primal_series)
+    intervals = _time_intervals(timestep_range)
+    num_processes = min(parameters["num_estimate_processes"], len(intervals))
+    if num_processes > 1 and MPI.num_processes() > 1:
+        info("Not forking processes for error estimation when running under MPI")
+        num_processes = 1
+    if num_processes > 1:
+        if fused_assembly:
+            forms = [R_fused, R0_S0, R0_S1, R0_S]
         else:
-            E_0_S += dt * numpy.dot(e0_S, [1.0/6.0, 1.0/6.0, 2.0/3.0])
-
-        E_0_M += dt * numpy.dot(e0_M, [1.0/6.0, 1.0/6.0, 2.0/3.0])
-
-        # Add to E_k
-        E_k += dt * dt * Rk
-
-        # Add to E_c's
-        E_c_F += dt * RcF
-        E_c_S += dt * RcS
-        E_c_M += dt * RcM
+            forms = [R0_F0, R0_F1, R0_F, R0_S0, R0_S1, R0_S, R0_M0, R0_M1, R0_M,
+                     Rk0_F + Rk0_S + Rk0_M, Rk1_F + Rk1_S + Rk1_M,
+                     Rc_F, Rc_S, Rc_M] + list(Rh_F) + list(Rh_S) + list(Rh_M)
+        partial_sums = _estimate_in_parallel(estimate_intervals, intervals,
+                                             num_processes, forms)
+    else:
+        partial_sums = [estimate_intervals(intervals)]
 
-        end()
+    # Add contributions from all slices (in order)
+    E_0_F, E_0_S, E_0_M, E_k, E_c_F, E_c_S, E_c_M, eta_F, eta_S, eta_M = \
+        _add_partial_sums(partial_sums)
 
     # Sum total error representation
     print "E_0_F = %.15f" % E_0_F
@@ -323,6 +409,50 @@ def estimate_error(problem, parameters):
 
     return E, eta_K, E_h, E_k, E_c
 
+# Function evaluated by worker processes in estimate_error
+_estimate_function = None
+
+def _estimate_worker(intervals):
+    "Evaluate estimate for slice of time intervals (in worker process)"
+    return _estimate_function(intervals)
+
+def _estimate_in_parallel(function, intervals, num_processes, forms=[]):
+    """Evaluate function on contiguous slices of intervals using a pool
+    of forked processes. The worker processes inherit the forms and
+    functions of the parent process, and each reads its own slice of
+    the time series. The given forms are compiled before forking so
+    that the workers do not compile them concurrently. Results are
+    returned in the order of the slices."""
+    global _estimate_function
+    for form in forms:
+        jit(form)
+    info("Estimating error in parallel on %d processes" % num_processes)
+    slices = [[int(i) for i in s] for s in numpy.array_split(intervals, num_processes)]
+    _estimate_function = function
+    pool = multiprocessing.Pool(num_processes)
+    try:
+        return pool.map(_estimate_worker, slices)
+    finally:
+        pool.close()
+        pool.join()
+        _estimate_function = None
+
+def _time_intervals(timestep_range):
+    "Return indices of the time intervals (t_{i-1}, t_i) of the stored time levels"
+    if len(timestep_range) < 2:
+        error("Unable to estimate error, need at least two stored time levels (found %d)." \
+              % len(timestep_range))
+    return range(1, len(timestep_range))
+
+def _add_partial_sums(partial_sums):
+    """Add error contributions (E_0_F, E_0_S, E_0_M, E_k, E_c_F, E_c_S,
+    E_c_M, eta_F, eta_S, eta_M) from slices of time intervals"""
+    errors = [sum(p[j] for p in partial_sums) for j in range(7)]
+    indicators = [[sum(p[j][k] for p in partial_sums)
+                   for k in range(len(partial_sums[0][j]))]
+                  for j in range(7, 10)]
+    return errors + indicators
+
 def init_adaptive_data(problem, parameters):
     "Initialize data needed for adaptive time stepping"
 
@@ -396,42 +526,92 @@ def refine_mesh(problem, mesh, indicators, parameters):
     # Get fraction of elements for refinement
     fraction = parameters["marking_fraction"]
 
-    # Create lists and markers for refinement
-    indices = list(argsort(indicators))
-    indices.reverse()
+    # Get marking strategy ("dorfler_marking" = False means fixed fraction)
+    strategy = parameters["marking_strategy"]
+    if strategy == "dorfler" and not parameters["dorfler_marking"]:
+        strategy = "fixed_fraction"
+
+    # Mark cells for refinement
+    info_blue("Refining using %s marking with fraction = %g" % (strategy, fraction))
+    cpu_time = python_time()
+    timings.start("Marking")
     markers = MeshFunction("bool", mesh, mesh.topology().dim())
-    markers.set_all(False)
-
-    # Dorfler marking strategy
-    if parameters["dorfler_marking"]:
-        info_blue("Refining using Dorfler fraction = %g" %fraction)
-        total_sum = sum(indicators)
-        sub_sum = 0.0
-        for i in indices:
-            sub_sum += indicators[i]
-            markers[int(i)] = True
-            if sub_sum >= fraction * total_sum:
-                  break
-
-    # "Standard" marking strategy
-    else:
-        info_blue("Refining with fraction = %g" %fraction)
-        stopping_criteria = int(round(len(indices) * fraction))
-        counter = 0
-        for i in indices:
-            counter += 1
-            markers[int(i)] = True
-            if counter == stopping_criteria:
-                break
+    markers.array()[:] = mark_cells(indicators, fraction, strategy)
+    timings.stop("Marking")
+    info("Marked %d of %d cells in %g seconds" % \
+         (numpy.sum(markers.array()), mesh.num_cells(), python_time() - cpu_time))
 
     # Save marked cells (for plotting)
-    save_refinement_markers(mesh, markers)
+    save_refinement_markers(mesh, markers, parameters)
 
     # Refine mesh
     refined_mesh = refine(mesh, markers)
 
     return refined_mesh
 
+def mark_cells(indicators, fraction, strategy):
+    """Return boolean array of cells marked for refinement. Strategies:
+
+      dorfler        - mark the largest indicators that together make up
+                       the given fraction of the total sum
+      fixed_fraction - mark the given fraction of cells with the largest
+                       indicators
+      equidistribution - mark cells with indicators above the average
+    """
+
+    indicators = numpy.asarray(indicators)
+    num_cells = len(indicators)
+    marked = numpy.zeros(num_cells, dtype=bool)
+    if num_cells == 0:
+        return marked
+
+    if strategy == "dorfler":
+
+        # Select largest indicators, growing the selection until it
+        # holds the fraction of the total sum (full sort as last resort)
+        target = fraction * numpy.sum(indicators)
+        if _has_argpartition:
+            num_selected = min(max(16, num_cells / 16), num_cells)
+        else:
+            num_selected = num_cells
+        while True:
+            selected = _largest_indicators(indicators, num_selected)
+            selected = selected[numpy.argsort(-indicators[selected], kind="mergesort")]
+            partial_sums = numpy.cumsum(indicators[selected])
+            if partial_sums[-1] >= target or num_selected == num_cells:
+                break
+            num_selected = min(2*num_selected, num_cells)
+
+        # Mark cells up to and including the one reaching the target
+        num_marked = min(numpy.searchsorted(partial_sums, target) + 1, num_selected)
+        marked[selected[:num_marked]] = True
+
+    elif strategy == "fixed_fraction":
+        num_marked = int(round(num_cells * fraction))
+        if num_marked >= num_cells:
+            marked[:] = True
+        elif num_marked > 0:
+            marked[_largest_indicators(indicators, num_marked)] = True
+
+    elif strategy == "equidistribution":
+        marked[indicators > numpy.mean(indicators)] = True
+
+    else:
+        error("Unknown marking strategy: %s" % strategy)
+
+    return marked
+
+# numpy.argpartition requires numpy >= 1.8, otherwise sort all indicators
+_has_argpartition = hasattr(numpy, "argpartition")
+
+def _largest_indicators(indicators, num):
+    "Return indices of the num largest indicators (in no particular order)"
+    if num >= len(indicators):
+        return numpy.arange(len(indicators))
+    if _has_argpartition:
+        return numpy.argpartition(-indicators, num - 1)[:num]
+    return numpy.argsort(-indicators, kind="mergesort")[:num]
+
 def refine_timestep(E_k, parameters):
     """Refine time steps (for next round) by adjusting the tolerance
     used to determine the adaptive time steps"""
@@ -603,17 +783,19 @@ def save_timestep(t1, Rk, dt, TOL_k, parameters):
     f.write("%g %g %g %g\n" % (t1, dt, Rk, TOL_k))
     f.close()
 
-def save_goal_functional(t1, goal_functional, integrated_goal_functional, parameters):
-    "Saving goal functional at t = t1"
+def save_goal_functional(t1, goal_functional, integrated_goal_functional, parameters,
+                         writer=None):
+    "Saving goal functional at t = t1 (in the background if writer is given)"
 
     global _refinement_level
 
     info("Value of goal functional   at t = %.16g: %.16g" % (t1, goal_functional))
     info("Integrated goal functional at t = %.16g: %.16g" % (t1, integrated_goal_functional))
 
-    f = open("%s/goal_functional.txt" % parameters["output_directory"], "a")
-    f.write("%d %.16g %.16g %.16g\n" % (_refinement_level, t1, goal_functional, integrated_goal_functional))
-    f.close()
+    append_to_file("%s/goal_functional.txt" % parameters["output_directory"],
+                   "%d %.16g %.16g %.16g\n" % (_refinement_level, t1, goal_functional,
+                                               integrated_goal_functional),
+                   writer)
 
 def save_goal_functional_final(goal_functional, integrated_goal_functional, reference_value, parameters):
     "Saving goal functional at final time"
@@ -639,14 +821,22 @@ def save_itertol(t1, tol, parameters):
     f.write("%d %g %g \n" % (_refinement_level, t1, tol))
     f.close()
 
-def save_no_FSI_iter(t1, no, parameters):
-    "Save number of FSI iterations"
+def save_no_FSI_iter(t1, no, parameters, writer=None):
+    "Save number of FSI iterations (in the background if writer is given)"
 
     global _refinement_level
 
-    f = open("%s/no_iterations.txt" % parameters["output_directory"], "a")
-    f.write("%d %g %g \n" % (_refinement_level, t1, no))
-    f.close()
+    append_to_file("%s/no_iterations.txt" % parameters["output_directory"],
+                   "%d %g %g \n" % (_refinement_level, t1, no), writer)
+
+def save_FSI_residuals(t1, residuals, parameters, writer=None):
+    "Save increments of FSI iterations (in the background if writer is given)"
+
+    global _refinement_level
+
+    append_to_file("%s/fsi_residuals.txt" % parameters["output_directory"],
+                   "".join("%d %g %d %g \n" % (_refinement_level, t1, i + 1, r)
+                           for (i, r) in enumerate(residuals)), writer)
 
 def save_dofs(num_dofs_FSM, timestep_counter, parameters):
     "Save number of total number of dofs"
@@ -668,18 +858,19 @@ def save_indicators(eta_F, eta_S, eta_M, eta_K, Omega, parameters):
     global indicator_files
     global _refinement_level
 
-    # Create mesh functions
-    plot_markers_F = [MeshFunction("double", Omega, Omega.topology().dim()) for i in range(len(eta_F))]
-    plot_markers_S = [MeshFunction("double", Omega, Omega.topology().dim()) for i in range(len(eta_S))]
-    plot_markers_M = [MeshFunction("double", Omega, Omega.topology().dim()) for i in range(len(eta_M))]
-    plot_markers_K =  MeshFunction("double", Omega, Omega.topology().dim())
+    # Save all indicators to a single binary file
+    if parameters["indicator_format"] == "binary":
+        numpy.savez("%s/indicators_%d.npz" % (parameters["output_directory"], _refinement_level),
+                    eta_F=eta_F, eta_S=eta_S, eta_M=eta_M, eta_K=eta_K)
+        return
+    elif not parameters["indicator_format"] == "pvd":
+        error("Unknown indicator format: %s" % parameters["indicator_format"])
 
-    # Extract error indicators
-    for i in range(Omega.num_cells()):
-        for j in range(len(eta_F)): plot_markers_F[j][i] = eta_F[j][i]
-        for j in range(len(eta_S)): plot_markers_S[j][i] = eta_S[j][i]
-        for j in range(len(eta_M)): plot_markers_M[j][i] = eta_M[j][i]
-        plot_markers_K[i] = eta_K[i]
+    # Create mesh functions
+    plot_markers_F = [array_to_meshfunction(eta, Omega) for eta in eta_F]
+    plot_markers_S = [array_to_meshfunction(eta, Omega) for eta in eta_S]
+    plot_markers_M = [array_to_meshfunction(eta, Omega) for eta in eta_M]
+    plot_markers_K =  array_to_meshfunction(eta_K, Omega)
 
     # Sum markers
     plot_markers = plot_markers_F + plot_markers_S + plot_markers_M + [plot_markers_K]
@@ -697,22 +888,23 @@ def save_indicators(eta_F, eta_S, eta_M, eta_K, Omega, parameters):
     for i in range(len(indicator_files) - 1):
         indicator_files[i] << plot_markers[i]
 
-def save_refinement_markers(mesh, markers):
+def save_refinement_markers(mesh, markers, parameters):
     "Save refinement markers for visualization"
 
+    # Save markers to binary file
+    if parameters["indicator_format"] == "binary":
+        numpy.save("%s/refinement_markers_%d.npy" % (parameters["output_directory"], _refinement_level),
+                   markers.array())
+        return
+
     # Create mesh functions
     refinement_markers = MeshFunction("uint", mesh, mesh.topology().dim())
 
-    # Reset plot markers
-    refinement_markers.set_all(0)
-
     # Extract error indicators
-    for i in range(mesh.num_cells()):
-        if markers[i]:
-            refinement_markers[i] = True
+    refinement_markers.array()[:] = markers.array()
 
     # Save markers
-    indicator_files[4] << refinement_markers
+    indicator_files[-1] << refinement_markers
 
 def refinement_level():
     "Return current refinement level"
@@ -0,0 +1,133 @@
+"""This module implements acceleration of the partitioned (fixed point)
+FSI iteration. The accelerators act on the interface displacement,
+that is, the structure displacement passed to the mesh problem:
+
+  none    - plain Gauss-Seidel iteration
+  aitken  - dynamic Aitken relaxation
+  iqn-ils - interface quasi-Newton with least-squares model, optionally
+            reusing secant information from previous time steps
+"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from numpy import array, dot
+from numpy.linalg import lstsq
+from dolfin import info, error
+
+def create_coupling_accelerator(parameters):
+    "Create accelerator for FSI iteration (None for plain iteration)"
+    method = parameters["coupling_acceleration"]
+    if method == "none":
+        return None
+    elif method == "aitken":
+        return AitkenRelaxation(parameters)
+    elif method == "iqn-ils":
+        return IQNILS(parameters)
+    else:
+        error("Unknown coupling acceleration: %s" % method)
+
+class CouplingAccelerator(object):
+    """Base class for accelerators. Given the result x_tilde = H(x) of
+    an iteration with interface displacement x, update() returns the
+    interface displacement for the next iteration."""
+
+    def __init__(self, parameters):
+        "Create accelerator"
+        self.omega0 = parameters["coupling_relaxation"]
+        self.new_time_step()
+
+    def new_time_step(self):
+        "Reset iteration (call at the start of each time step)"
+        self.x = None
+        self.x_tilde = None
+        self.r = None
+
+    def update(self, x_tilde):
+        "Return next interface displacement"
+
+        # Use result of first iteration as starting point
+        x_tilde = x_tilde.copy()
+        if self.x is None:
+            x = x_tilde
+        else:
+            r = x_tilde - self.x
+            x = self.compute(x_tilde, r)
+            self.r = r
+
+        # Store values for next iteration
+        self.x_tilde = x_tilde
+        self.x = x
+
+        return x
+
+    def compute(self, x_tilde, r):
+        "Compute next interface displacement from result and residual"
+        return x_tilde
+
+class AitkenRelaxation(CouplingAccelerator):
+    "Dynamic Aitken relaxation"
+
+    def compute(self, x_tilde, r):
+
+        # Update relaxation factor
+        if self.r is None:
+            self.omega = self.omega0
+        else:
+            dr = r - self.r
+            denominator = dot(dr, dr)
+            if denominator > 0.0:
+                self.omega = -self.omega * dot(self.r, dr) / denominator
+        info("Aitken relaxation factor: omega = %g" % self.omega)
+
+        return self.x + self.omega*r
+
+class IQNILS(CouplingAccelerator):
+    """Interface quasi-Newton with inverse Jacobian from a least-squares
+    model (IQN-ILS). Differences of residuals (V) and results (W) from
+    the current time step and the coupling_reuse previous time steps
+    are used to approximate the inverse Jacobian of the residual."""
+
+    def __init__(self, parameters):
+        "Create accelerator"
+        self.reuse = parameters["coupling_reuse"]
+        self.V = []
+        self.W = []
+        self.old = []
+        CouplingAccelerator.__init__(self, parameters)
+
+    def new_time_step(self):
+        "Reset iteration, keeping secant information for reuse"
+        if len(self.V) > 0:
+            self.old.insert(0, (self.V, self.W))
+        del self.old[self.reuse:]
+        self.V = []
+        self.W = []
+        CouplingAccelerator.new_time_step(self)
+
+    def compute(self, x_tilde, r):
+
+        # Add new secant information (newest first)
+        if self.r is not None:
+            self.V.insert(0, r - self.r)
+            self.W.insert(0, x_tilde - self.x_tilde)
+
+        # Collect columns from current and previous time steps
+        V = list(self.V)
+        W = list(self.W)
+        for (V_old, W_old) in self.old:
+            V += V_old
+            W += W_old
+
+        # Use relaxation until we have secant information
+        if len(V) == 0:
+            return self.x + self.omega0*r
+
+        # Solve least-squares problem V c = -r and update
+        V = array(V).T
+        W = array(W).T
+        c = lstsq(V, -r, rcond=1e-12)[0]
+        info("IQN-ILS update using %d secant pairs" % V.shape[1])
+
+        return x_tilde + dot(W, c)
@@ -7,6 +7,7 @@ __license__  = "GNU GPL Version 3 or any later version"
 # Last changed: 2012-05-03
 
 from time import time as python_time
+import numpy
 from dolfin import *
 from spaces import *
 from storage import *
@@ -30,6 +31,7 @@ def solve_dual(problem, parameters):
     Omega_S = problem.structure_mesh()
     save_solution = parameters["save_solution"]
     plot_solution = parameters["plot_solution"]
+    buffer_matrix = parameters["dualsolver"]["buffer_matrix"]
 
     # Create files for saving to VTK
     files = None
@@ -48,8 +50,8 @@ def solve_dual(problem, parameters):
                  Y_M_file]
 
     # Create time series for storing solution
-    primal_series = create_primal_series(parameters)
-    dual_series = create_dual_series(parameters)
+    primal_series = create_primal_series(parameters, level)
+    dual_series = create_dual_series(parameters, level)
 
     # Record CPU time
     cpu_time = python_time()
@@ -76,12 +78,24 @@ def solve_dual(problem, parameters):
     k = Constant(0.0)
 
     # Create variational forms for dual problem
-    A, L = create_dual_forms(Omega_F, Omega_S, k, problem,
-                             v_F,  q_F,  s_F,  v_S,  q_S,  v_M,  q_M,
-                             Z_F,  Y_F,  X_F,  Z_S,  Y_S,  Z_M,  Y_M,
-                             Z_F0, Y_F0, X_F0, Z_S0, Y_S0, Z_M0, Y_M0,
-                             U_F0, P_F0, U_S0, P_S0, U_M0,
-                             U_F1, P_F1, U_S1, P_S1, U_M1,parameters)
+    forms = create_dual_forms(Omega_F, Omega_S, k, problem,
+                              v_F,  q_F,  s_F,  v_S,  q_S,  v_M,  q_M,
+                              Z_F,  Y_F,  X_F,  Z_S,  Y_S,  Z_M,  Y_M,
+                              Z_F0, Y_F0, X_F0, Z_S0, Y_S0, Z_M0, Y_M0,
+                              U_F0, P_F0, U_S0, P_S0, U_M0,
+                              U_F1, P_F1, U_S1, P_S1, U_M1,parameters,
+                              buffered=buffer_matrix)
+    if buffer_matrix:
+        A, L, A_buff = forms
+    else:
+        A, L = forms
+
+    # Buffered matrix and the time step used to assemble it
+    buffered_matrix = None
+    buffered_dt = None
+
+    # Create linear solver
+    solver = DualLinearSolver(parameters["dualsolver"])
 
     # Create dual boundary conditions
     bcs = create_dual_bcs(problem, W)
@@ -92,6 +106,7 @@ def solve_dual(problem, parameters):
     # Time-stepping
     T  = problem.end_time()
     timestep_range = read_timestep_range(T, primal_series)
+    prefetcher = create_prefetcher(reversed(timestep_range), primal_series, parameters)
     for i in reversed(range(len(timestep_range) - 1)):
 
         # Get current time and time step
@@ -106,18 +121,43 @@ def solve_dual(problem, parameters):
         begin("* Starting new time step")
         info_blue("* t = %g (T = %g, dt = %g)" % (t0, T, dt))
 
-        # Read primal data
-        read_primal_data(U0, t0, Omega, Omega_F, Omega_S, primal_series, parameters)
-        read_primal_data(U1, t1, Omega, Omega_F, Omega_S, primal_series, parameters)
+        # Read primal data (data at t1 was read as t0 in the previous step)
+        if i == len(timestep_range) - 2:
+            read_primal_data(U1, t1, Omega, Omega_F, Omega_S, primal_series, parameters,
+                             prefetcher)
+        else:
+            copy_primal_data(U1, U0)
+        read_primal_data(U0, t0, Omega, Omega_F, Omega_S, primal_series, parameters,
+                         prefetcher)
 
         # GB: In the Analytic problem there are no do nothing fluid boundaries. I am not
         # this is reflected here in the meshfunctions and their facet numberings.
         # Assemble matrix
         info("Assembling matrix")
-        matrix = assemble(A,
-                          cell_domains=problem.cell_domains,
-                          exterior_facet_domains=problem.fsi_boundary,
-                          interior_facet_domains=problem.fsi_boundary)
+        if buffer_matrix:
+
+            # Reassemble buffered part when the time step changes
+            if buffered_dt is None or abs(dt - buffered_dt) > 1e-10*dt:
+                info("Assembling buffered matrix")
+                buffered_matrix = assemble(A_buff,
+                                           cell_domains=problem.cell_domains,
+                                           exterior_facet_domains=problem.fsi_boundary,
+                                           interior_facet_domains=problem.fsi_boundary)
+                buffered_dt = dt
+
+            # Add primal dependent part to buffered part
+            matrix = buffered_matrix.copy()
+            matrix = assemble(A, tensor=matrix,
+                              cell_domains=problem.cell_domains,
+                              exterior_facet_domains=problem.fsi_boundary,
+                              interior_facet_domains=problem.fsi_boundary,
+                              reset_sparsity=False,
+                              add_values=True)
+        else:
+            matrix = assemble(A,
+                              cell_domains=problem.cell_domains,
+                              exterior_facet_domains=problem.fsi_boundary,
+                              interior_facet_domains=problem.fsi_boundary)
 
         # Assemble vector
         info("Assembling vector")
@@ -135,8 +175,8 @@ def solve_dual(problem, parameters):
         for bc in bcs:
             bc.apply(matrix, vector)
 
-        # Solve linear system
-        solve(matrix, Z0.vector(), vector)
+        # Solve linear system (Z0 holds the solution from the previous step)
+        solver.solve(matrix, Z0.vector(), vector)
         info("Solved linear system: ||Z|| = " + str(Z0.vector().norm("l2")))
 
         # Save and plot solution
@@ -148,9 +188,100 @@ def solve_dual(problem, parameters):
         Z1.assign(Z0)
         end()
 
+    # Stop background reading
+    if prefetcher is not None:
+        prefetcher.close()
+
     # Report elapsed time
     info_blue("Dual solution computed in %g seconds." % (python_time() - cpu_time))
 
+class DualLinearSolver(object):
+    """Linear solver for the dual problem. If reuse_factorization is
+    set, the LU factorization from a previous time step is used as a
+    preconditioner for GMRES, starting from the previous dual solution.
+    When the primal solution changes slowly, a few cheap iterations
+    replace a full factorization. The matrix is refactorized if GMRES
+    does not converge within reuse_iterations iterations."""
+
+    def __init__(self, parameters):
+        "Create linear solver"
+        self.reuse = parameters["reuse_factorization"]
+        self.tolerance = parameters["reuse_tolerance"]
+        self.maxiter = parameters["reuse_iterations"]
+        self.matrix = None
+        self.lusolver = None
+        self.basis = None
+
+    def solve(self, matrix, x, b):
+        "Solve linear system"
+
+        # Plain direct solve
+        if not self.reuse:
+            solve(matrix, x, b)
+            return
+
+        # Try reusing old factorization
+        if self.lusolver is not None and self._gmres(matrix, x, b):
+            return
+
+        # Factorize new matrix (keep reference to matrix for the solver)
+        info("Factorizing dual matrix")
+        self.matrix = matrix
+        self.lusolver = LUSolver(matrix)
+        self.lusolver.parameters["reuse_factorization"] = True
+        self.lusolver.solve(x, b)
+
+    def _gmres(self, matrix, x, b):
+        """GMRES right preconditioned by the old factorization, starting
+        from x. Return True if converged."""
+
+        b_norm = b.norm("l2")
+        if b_norm == 0.0:
+            x.zero()
+            return True
+
+        # Work vectors with the layout of x (allocated once)
+        m = self.maxiter
+        if self.basis is None or not self.basis[0].size() == x.size():
+            self.basis = [x.copy() for i in range(2*m + 1)]
+        V = self.basis[:m + 1]
+        Z = self.basis[m + 1:]
+
+        # Compute initial residual r = b - Ax
+        matrix.mult(x, V[0])
+        V[0] *= -1.0
+        V[0].axpy(1.0, b)
+        beta = V[0].norm("l2")
+        if beta / b_norm < self.tolerance:
+            info("Reused dual factorization, converged in 0 iterations")
+            return True
+        V[0] *= 1.0 / beta
+        residual = beta / b_norm
+
+        # Arnoldi iteration with least-squares residual
+        H = numpy.zeros((m + 1, m))
+        e = numpy.zeros(m + 1)
+        e[0] = beta
+        for j in range(m):
+            self.lusolver.solve(Z[j], V[j])
+            matrix.mult(Z[j], V[j + 1])
+            for i in range(j + 1):
+                H[i, j] = V[j + 1].inner(V[i])
+                V[j + 1].axpy(-H[i, j], V[i])
+            H[j + 1, j] = V[j + 1].norm("l2")
+            y = numpy.linalg.lstsq(H[:j + 2, :j + 1], e[:j + 2], rcond=-1)[0]
+            residual = numpy.linalg.norm(numpy.dot(H[:j + 2, :j + 1], y) - e[:j + 2]) / b_norm
+            if residual < self.tolerance or H[j + 1, j] == 0.0:
+                for i in range(j + 1):
+                    x.axpy(y[i], Z[i])
+                info("Reused dual factorization, converged in %d iterations" % (j + 1))
+                return True
+            V[j + 1] *= 1.0 / H[j + 1, j]
+
+        info("Reused dual factorization reached the iteration limit %d (residual = %g), refactorizing" \
+             % (m, residual))
+        return False
+
 def _save_solution(Z, files):
     "Save solution to VTK"
 
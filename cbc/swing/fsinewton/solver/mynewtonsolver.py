@@ -13,6 +13,8 @@ from cbc.swing.fsinewton.solver.spaces import FSISubSpaceLocator
 from cbc.swing.fsinewton.utils.timings import timings
 from cbc.swing.fsinewton.utils.newtonsolveruntimedata import MyNewtonSolverRunTimeData
 import copy
+import math
+from time import time as python_time
 
 class MyNonlinearProblem:
     def __init__(self,f,w,bc,j, J_buff = None, cell_domains = None,
@@ -38,7 +40,8 @@ class MyNonlinearProblem:
 class MyNewtonSolver:
     """General purpose Python Newton Solver"""
     def __init__(self,problem, tol = 1.0e-13, itrmax = 30,reuse_jacobian = False,
-                 max_reuse_jacobian = 5, runtimedata = "False",reduce_quadrature = 0):
+                 max_reuse_jacobian = 5, runtimedata = "False",reduce_quadrature = 0,
+                 globalization = "none", reuse_policy = "fixed"):
         self.tol = tol
         self.itrmax = itrmax
         self.itr = 0
@@ -50,8 +53,24 @@ class MyNewtonSolver:
         self.inc = Function(self.fsispace)
         self.reuse_jacobian = reuse_jacobian
         self.max_reuse_jacobian = max_reuse_jacobian
+        #Adaptive reuse policy, kept for all time steps on this mesh level
+        if reuse_policy == "adaptive":
+            self.reusepolicy = JacobianReusePolicy(max_reuse_jacobian)
+        elif reuse_policy == "fixed":
+            self.reusepolicy = None
+        else:
+            raise Exception("Unknown Jacobian reuse policy %s" % reuse_policy)
         self.runtimedata = runtimedata
         (self.F,self.J) = (None,None)
+        #One LU solver for the lifetime of the Jacobian (sparsity is fixed)
+        self.linsolver = None
+        self.refactorize = True
+        #Globalization of the Newton step ("none", "armijo" or "damped")
+        if globalization not in ("none","armijo","damped"):
+            raise Exception("Unknown globalization %s" % globalization)
+        self.globalization = globalization
+        self.damping = 1.0
+        self.residual_current = False
         if self.problem.bc != None:
             [bc.homogenize() for bc in self.problem.bc]
         self.ffc_opt = {"representation": "quadrature"}
@@ -73,8 +92,11 @@ class MyNewtonSolver:
             self.runtimedata = MyNewtonSolverRunTimeData(t)
         self.itr = 0
         self.E = self.tol + 100
-        self.jacobian_itr = 0
+        if self.reusepolicy is None:
+            self.jacobian_itr = 0
         self.res = [] 
+        self.damping = 1.0
+        self.residual_current = False
         
         while self.E > self.tol:
             self.step(self.tol,method = method, inc_plot = inc_plot)
@@ -83,9 +105,12 @@ class MyNewtonSolver:
     def step(self,tol,method = "lu",inc_plot = False):
         """Do one Newton iteration"""
         info("Executing Newton Iteration")
+        steptime = python_time()
         
-        #Build Residual 
-        self.build_residual()            
+        #Build Residual (unless already assembled by the line search)
+        if not self.residual_current:
+            self.build_residual()            
+        self.residual_current = False
         
         #Check for convergence, F(u) should be close to 0.
         #Get the discrete 2 norm of the increment
@@ -106,9 +131,16 @@ class MyNewtonSolver:
             return
 
         #Rebuild jacobian if neccessary (for example if a blow up starts)
-        if self.reuse_jacobian == False or \
-        self.jacobian_itr == self.max_reuse_jacobian or\
-        self.E > self.lastresidual:
+        if self.reusepolicy is not None:
+            if self.itr > 0:
+                self.reusepolicy.record_rate(self.E,self.lastresidual)
+            rebuild = self.reuse_jacobian == False or \
+                      self.reusepolicy.rebuild(self.E,tol,self.jacobian_itr)
+        else:
+            rebuild = self.reuse_jacobian == False or \
+                      self.jacobian_itr == self.max_reuse_jacobian or\
+                      self.E > self.lastresidual
+        if rebuild:
             self.build_jacobian()
             self.jacobian_itr = 0
 
@@ -125,8 +157,16 @@ class MyNewtonSolver:
         #Linear Solve
         self.linear_solve()
 
-        self.problem.w.vector()[:] += self.inc.vector()
+        #Update solution
+        if self.globalization == "armijo":
+            self.armijo_update()
+        elif self.globalization == "damped":
+            self.damped_update()
+        else:
+            self.problem.w.vector()[:] += self.inc.vector()
         self.res += [(self.itr,self.E)]
+        if self.reusepolicy is not None:
+            self.reusepolicy.record_step(python_time() - steptime,rebuild)
         self.jacobian_itr += 1
         self.itr +=1
 
@@ -135,11 +175,45 @@ class MyNewtonSolver:
             R.vector()[:] = self.F
             raise NewtonConverganceError(self.itrmax, R)
 
+    def armijo_update(self,c = 1.0e-4,maxhalvings = 10):
+        """
+        Backtracking line search on the residual norm. The residual at
+        the accepted step is kept for the next iteration.
+        """
+        w0 = self.problem.w.vector().copy()
+        lam = 1.0
+        for i in range(maxhalvings + 1):
+            self.problem.w.vector()[:] = w0
+            self.problem.w.vector().axpy(lam,self.inc.vector())
+            self.build_residual()
+            E = np.linalg.norm(self.F.array(),ord = 2)
+            if E <= (1.0 - c*lam)*self.E or i == maxhalvings:
+                break
+            lam *= 0.5
+        info("Armijo line search: step length %g" % lam)
+        self.residual_current = True
+
+    def damped_update(self,mindamping = 0.1):
+        """
+        Damped step based on the residual norms already computed. The
+        step is shortened when the residual grows and lengthened again
+        when it decreases.
+        """
+        if self.itr > 0 and self.E > self.lastresidual:
+            self.damping = max(mindamping,self.damping*self.lastresidual/self.E)
+        else:
+            self.damping = min(1.0,2.0*self.damping)
+        info("Damped Newton step: damping %g" % self.damping)
+        self.problem.w.vector().axpy(self.damping,self.inc.vector())
+
     def linear_solve(self):
         """Dolfin/PETSc linear solve"""
         timings.startnext("PETSc linear solve")
         info("PETSc Linear Solve")
+        #Numeric factorization only after the Jacobian has been rebuilt
+        self.linsolver.parameters["reuse_factorization"] = not self.refactorize
         self.linsolver.solve(self.inc.vector(),-self.F)        
+        self.refactorize = False
         timings.stop("PETSc linear solve")         
 ##        #Benchmark
 ##        import fsinewton.utils.solver_benchmark as bench
@@ -158,10 +232,17 @@ class MyNewtonSolver:
         """Assemble Jacobian"""
         info("Assembling Jacobian")
         
+        #Keep the matrix (and its sparsity pattern) between rebuilds
+        first = self.J is None
+        
         #If buffered matrix add the variable part to the buffered part.
         if self.problem.J_buff is not None:
             timings.startnext("Copy Buffered Jacobian")
-            self.J = self.problem.J_buff.copy()
+            if first:
+                self.J = self.problem.J_buff.copy()
+            else:
+                self.J.zero()
+                self.J.axpy(1.0, self.problem.J_buff, True)
 
             timings.startnext("Jacobian Assembly")
             self.J = assemble(self.problem.j, tensor = self.J,
@@ -179,14 +260,21 @@ class MyNewtonSolver:
                               cell_domains = self.problem.cell_domains,
                               interior_facet_domains = self.problem.interior_facet_domains,
                               exterior_facet_domains = self.problem.exterior_facet_domains,
+                              reset_sparsity = first,
                               form_compiler_parameters = self.ffc_opt)
             timings.stop("Jacobian Assembly")
         #Give the Jacobian it's BC.
         self.apply_ident_bc()
-        #Create an LU Solver
-        # Create linear solver and factorize matrix
-        self.linsolver = LUSolver(self.J)
-        self.linsolver.parameters["reuse_factorization"] = True
+        self.init_linear_solver()
+
+    def init_linear_solver(self):
+        """Prepare the linear solver for a rebuilt Jacobian"""
+        #Create the LU Solver once, later rebuilds only refactorize
+        #numerically and keep the symbolic factorization and ordering
+        if self.linsolver is None:
+            self.linsolver = LUSolver(self.J)
+            self.linsolver.parameters["same_nonzero_pattern"] = True
+        self.refactorize = True
         
     def build_residual(self):
         """Assemble Residual"""
@@ -204,51 +292,252 @@ class MyNewtonSolver:
 ####        print self.F.array()
 ##        exit()
 
+class JacobianReusePolicy:
+    """
+    Decide when to rebuild the Jacobian from the measured contraction
+    factor of the Newton iteration and the measured cost of a step with
+    and without rebuilding (assembly and factorization). The
+    measurements are running averages kept over all time steps.
+    """
+    def __init__(self,max_reuse,weight = 0.5):
+        self.max_reuse = max_reuse
+        self.weight = weight
+        self.cost_step = None
+        self.cost_rebuild_step = None
+        self.rate = None
+        self.rate_fresh = None
+        self.fresh = False
+
+    def average(self,old,new):
+        """Running average of measurements"""
+        if old is None:
+            return new
+        return (1.0 - self.weight)*old + self.weight*new
+
+    def record_step(self,seconds,rebuilt):
+        """Record the time of a Newton step"""
+        if rebuilt:
+            self.cost_rebuild_step = self.average(self.cost_rebuild_step,seconds)
+        else:
+            self.cost_step = self.average(self.cost_step,seconds)
+        self.fresh = rebuilt
+
+    def record_rate(self,E,lastresidual):
+        """Record the contraction factor of the last step"""
+        if not lastresidual > 0.0:
+            return
+        self.rate = E/lastresidual
+        if self.fresh:
+            self.rate_fresh = self.average(self.rate_fresh,self.rate)
+        info("Newton contraction factor %g" % self.rate)
+
+    def rebuild(self,E,tol,jacobian_itr):
+        """
+        Return True if rebuilding the Jacobian is expected to pay off.
+        Only called before a step, that is when the residual E > tol.
+        """
+        if jacobian_itr >= self.max_reuse:
+            return True
+        if self.rate is None:
+            return False
+        if self.rate >= 1.0:
+            return True
+        if None in (self.cost_step,self.cost_rebuild_step,self.rate_fresh) or \
+           self.rate_fresh >= self.rate:
+            return False
+
+        #Compare the estimated cost of finishing with and without rebuild
+        cost_jacobian = max(self.cost_rebuild_step - self.cost_step,0.0)
+        n_reuse = math.log(tol/E)/math.log(self.rate)
+        n_fresh = math.log(tol/E)/math.log(max(self.rate_fresh,DOLFIN_EPS))
+        return cost_jacobian + n_fresh*self.cost_step < n_reuse*self.cost_step
+
+class MyNewtonKrylovSolver(MyNewtonSolver):
+    """
+    Inexact Newton solver using GMRES with Eisenstat-Walker forcing terms
+    and a block diagonal preconditioner for the fluid, structure and
+    mesh blocks (see FSIBlockPreconditioner).
+
+    The Jacobian is copied to scipy and solved with serial scipy GMRES,
+    so this solver is for small problems in serial only. Use the "lu"
+    or "reduced" linear solvers for large problems and under MPI.
+    """
+    #Primary and constraint fields of the fluid, structure and mesh blocks
+    blocks = [(("U_F",),("P_F","L_U")),
+              (("D_S","U_S"),()),
+              (("D_F",),("L_D",))]
+    
+    def __init__(self,problem,krylov = None,**kwargs):
+        if MPI.num_processes() > 1:
+            raise Exception("The Newton-Krylov solver only runs in serial")
+        MyNewtonSolver.__init__(self,problem,**kwargs)
+        if krylov is None:
+            krylov = {"preconditioner":"ilu","initial_forcing":0.5,
+                      "maximum_forcing":0.9,"maximum_iterations":500,
+                      "restart":100}
+        self.krylov = krylov
+        self.eta = krylov["initial_forcing"]
+        self.J_csr = None
+        self.preconditioner = None
+
+        #Dofs of each block from the subspace ranges
+        subloc = FSISubSpaceLocator(self.fsispace)
+        fielddofs = lambda fields: np.concatenate([np.arange(subloc.spacebegins[f],
+                                                             subloc.spaceends[f])
+                                                   for f in fields] + [np.zeros(0,dtype = int)])
+        self.blockdofs = [(fielddofs(p),fielddofs(c)) for (p,c) in self.blocks]
+
+    def forcing_term(self):
+        """Eisenstat-Walker (choice 2) relative tolerance for GMRES"""
+        gamma,alpha = 0.9,2.0
+        eta_max = self.krylov["maximum_forcing"]
+        if self.itr == 0:
+            self.eta = self.krylov["initial_forcing"]
+        else:
+            eta_old = self.eta
+            self.eta = gamma*(self.E/self.lastresidual)**alpha
+            #Safeguard against too rapid decrease
+            if gamma*eta_old**alpha > 0.1:
+                self.eta = max(self.eta,gamma*eta_old**alpha)
+            self.eta = min(self.eta,eta_max)
+        return self.eta
+
+    def init_linear_solver(self):
+        """Extract the Jacobian and rebuild the block preconditioner"""
+        timings.startnext("Block preconditioner")
+        self.J_csr = mf.dolfin_to_csr(self.J)
+        self.preconditioner = FSIBlockPreconditioner(self.J_csr,self.blockdofs,
+                                                     self.krylov["preconditioner"])
+        timings.stop("Block preconditioner")
+
+    def linear_solve(self):
+        """GMRES solve to the Eisenstat-Walker tolerance"""
+        from scipy.sparse.linalg import gmres
+        timings.startnext("Krylov linear solve")
+        eta = self.forcing_term()
+        info("Krylov Linear Solve (relative tolerance %g)" % eta)
+        residuals = []
+        #Older scipy counts maxiter in inner iterations, newer in restarts
+        x,flag = gmres(self.J_csr,-self.F.array(),tol = eta,
+                       restart = self.krylov["restart"],
+                       maxiter = self.krylov["maximum_iterations"],
+                       M = self.preconditioner.operator(),
+                       callback = residuals.append)
+        if flag < 0:
+            raise Exception("GMRES breakdown in Newton-Krylov solve")
+        elif flag > 0:
+            info("GMRES did not reach tolerance %g in %d iterations" % (eta,len(residuals)))
+        else:
+            info("GMRES converged in %d iterations" % len(residuals))
+        self.inc.vector()[:] = x
+        timings.stop("Krylov linear solve")
+
+def approximate_inverse(A,method):
+    """
+    Return a function applying an approximate inverse of the scipy
+    sparse matrix A (method "ilu", "amg" or "lu")
+    """
+    from scipy.sparse.linalg import spilu, splu
+    if method == "ilu":
+        return spilu(A.tocsc(),drop_tol = 1.0e-4,fill_factor = 10).solve
+    elif method == "lu":
+        return splu(A.tocsc()).solve
+    elif method == "amg":
+        try:
+            import pyamg
+        except ImportError:
+            raise Exception("The AMG block preconditioner requires pyamg")
+        return pyamg.smoothed_aggregation_solver(A.tocsr()).aspreconditioner().matvec
+    else:
+        raise Exception("Unknown block preconditioner %s" % method)
+
+class SaddlePointBlock:
+    """
+    Preconditioner for a diagonal block [A B^T; B C] of the Jacobian,
+    where the constraint rows (pressure and Lagrange multipliers) may
+    have zero diagonals. The block upper triangular approximation
+    [A B^T; 0 S] is used, with the Schur complement approximated by
+    S = C - B diag(A)^-1 B^T. Without constraint dofs this is just an
+    approximate inverse of A.
+    """
+    def __init__(self,J,primary,constraint,method):
+        from scipy.sparse import diags
+        rows = J[primary]
+        self.n = len(primary)
+        self.inv_A = approximate_inverse(rows[:,primary],method)
+        self.inv_S = None
+        if len(constraint) > 0:
+            self.Bt = rows[:,constraint]
+            crows = J[constraint]
+            d = rows[:,primary].diagonal()
+            d[d == 0.0] = 1.0
+            S = crows[:,constraint] - crows[:,primary]*diags(1.0/d)*self.Bt
+            self.inv_S = approximate_inverse(S,method)
+
+    def solve(self,r):
+        """Apply the preconditioner to r (primary dofs first)"""
+        if self.inv_S is None:
+            return self.inv_A(r)
+        y_c = self.inv_S(r[self.n:])
+        y_u = self.inv_A(r[:self.n] - self.Bt*y_c)
+        return np.concatenate((y_u,y_c))
+
+class FSIBlockPreconditioner:
+    """
+    Block diagonal preconditioner for the monolithic FSI Jacobian given
+    as a scipy sparse matrix. Each block is given by its primary and
+    constraint dofs and preconditioned by a SaddlePointBlock. Dofs not
+    in any block are left unchanged.
+    """
+    def __init__(self,J,blockdofs,method):
+        J = J.tocsr()
+        self.shape = J.shape
+        self.blocks = [(np.concatenate((p,c)),SaddlePointBlock(J,p,c,method))
+                       for (p,c) in blockdofs]
+
+    def apply(self,r):
+        """Apply the preconditioner to r"""
+        y = np.array(r,dtype = float).ravel()
+        for dofs,block in self.blocks:
+            y[dofs] = block.solve(y[dofs])
+        return y
+
+    def operator(self):
+        """Return the preconditioner as a scipy LinearOperator"""
+        from scipy.sparse.linalg import LinearOperator
+        return LinearOperator(self.shape,matvec = self.apply)
+
 class MyNewtonSolverNumpy(MyNewtonSolver):
-    """Newton Solver using numpy linear algebra and fsi space restriction"""
-    def build_jacobian(self):
-        #Build the normal jacobian
-        MyNewtonSolver.build_jacobian(self)
-        #Now Turn it into a numpy array and remove excess dofs
-        
-        self.J_np = self.J.array()
-        dofs = self.problem.spaces.usefuldofs
-            
-##        print "Array size before dof removal",len(self.J_np)
-##        print "Condition number before dof removal",np.linalg.cond(self.J_np)
-##        print "Norm before dof removal",np.linalg.norm(self.J_np,2)
-        
-        #Remove the uneccessary parts of the matrix.
-        self.J_np = self.J_np[dofs].transpose()[dofs].transpose()
-        
-##        print "Array size after dof removal",len(self.J_np)
-##        print "Condition number after dof removal",np.linalg.cond(self.J_np)
-##        print "Norm after dof removal",np.linalg.norm(self.J_np,2)
+    """
+    Newton Solver using a sparse direct solve restricted to the useful
+    fsi dofs. The dead dofs are eliminated instead of using ident_zeros.
+    """
+    def apply_ident_bc(self):
+        """Apply BC, dead DOFS are removed in the reduced system"""
+        if self.problem.bc != None:
+            [bc.apply(self.J) for bc in self.problem.bc]
+
+    def init_linear_solver(self):
+        """Extract the reduced Jacobian and factorize it"""
+        from scipy.sparse.linalg import splu
+        timings.startnext("Sparse factorization")
+        self.dofs = np.array(self.problem.spaces.usefuldofs,dtype = np.int64)
+        self.J_sp = mf.csr_submatrix(self.J,self.dofs)
+        self.linsolver = splu(self.J_sp.tocsc())
+        timings.stop("Sparse factorization")
 
     def linear_solve(self):
         """
-        Solve Ax = b with numpy and also with removal of uneccesary rows
+        Solve Ax = b with scipy and also with removal of uneccesary rows
         using the spaces object
         """
         timings.startnext("Numpy linear solve")
         info("Numpy Linear Solve")
-        dofs = self.problem.spaces.usefuldofs
 
-        #Original np array
+        #Solve the reduced system and map the solution back
         b = -self.F.array()
-        #New np array
-        b_np = b[dofs]
-        #Solve the system
-        x_np = np.linalg.solve(self.J_np,b_np)
-
-        #map the solution back to the bigger space
         x = np.zeros(len(b))
-        x[dofs] = x_np
-
-##        #Create a Vector
-        x_vec = Vector(len(x))
-        x_vec[:] = x
-##        
+        x[self.dofs] = self.linsolver.solve(b[self.dofs])
         self.inc.vector()[:] = x
         timings.stop("Numpy linear solve")
 
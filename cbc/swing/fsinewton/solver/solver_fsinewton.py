@@ -7,6 +7,7 @@ __license__  = "GNU GPL Version 3 or any later version"
 
 from dolfin import *
 import numpy as np
+from collections import deque
 import cbc.common as ccom
 import residualforms as rf
 import jacobianforms as jfor
@@ -15,7 +16,7 @@ from boundary_conditions import FSIBC
 from spaces import FSISpaces
 from mynewtonsolver import MyNonlinearProblem,MyNewtonSolver, \
                                             NewtonConverganceError,NanError, \
-                                            MyNewtonSolverNumpy
+                                            MyNewtonSolverNumpy, MyNewtonKrylovSolver
 from cbc.swing.fsinewton.utils.output import FSIPlotter, FSIStorer
 from cbc.swing.parameters import fsinewton_params
 from cbc.swing.fsinewton.utils.runtimedata import FsiRunTimeData
@@ -56,6 +57,14 @@ class FSINewtonSolver(ccom.CBCSolver):
         self.dt = self.problem.initial_step()
         self.kn = Constant(self.dt)
         self.t = 0.0
+
+        #Ring buffer of accepted states (t,U) used by the predictor
+        self.predictor = self.params["predictor"]
+        order = {"constant":0,"linear":1,"quadratic":2}
+        if self.predictor not in order:
+            raise Exception("Only 'constant', 'linear' and 'quadratic' are possible \
+                            values for the parameter 'predictor'")
+        self.history = deque(maxlen = order[self.predictor] + 1)
         
         #Define Time Descretized Functions
         self.Umid,self.Udot = self.time_discreteU(self.U1list,self.U0list,self.kn)
@@ -89,13 +98,28 @@ class FSINewtonSolver(ccom.CBCSolver):
                            spaces = self.spaces)
         
         #Create a Newton Solver object
-        self.newtonsolver = MyNewtonSolver(self.nonlinearproblem,
+        if self.params["linear_solver"] == "krylov":
+            newtonsolver = MyNewtonKrylovSolver
+            kwargs = {"krylov": self.params["krylov"]}
+        elif self.params["linear_solver"] == "reduced":
+            newtonsolver = MyNewtonSolverNumpy
+            kwargs = {}
+        elif self.params["linear_solver"] == "lu":
+            newtonsolver = MyNewtonSolver
+            kwargs = {}
+        else:
+            raise Exception("Only 'lu', 'reduced' and 'krylov' are possible values \
+                            for the parameter 'linear_solver'")
+        self.newtonsolver = newtonsolver(self.nonlinearproblem,
                                            itrmax = self.params["newtonitrmax"],
                                            reuse_jacobian = self.params["optimization"]["reuse_jacobian"],
                                            max_reuse_jacobian = self.params["optimization"]["max_reuse_jacobian"],
                                            runtimedata = self.params["runtimedata"]["newtonsolver"],
                                            tol = self.params["newtonsoltol"],
-                                           reduce_quadrature =  self.params["optimization"]["reduce_quadrature"] )
+                                           reduce_quadrature =  self.params["optimization"]["reduce_quadrature"],
+                                           globalization = self.params["globalization"],
+                                           reuse_policy = self.params["optimization"]["reuse_policy"],
+                                           **kwargs)
          
         info_blue("Newton Solver Tolerance is %s"%self.newtonsolver.tol)
         self.prebuild_jacobians()
@@ -145,12 +169,16 @@ class FSINewtonSolver(ccom.CBCSolver):
         #update the body forces
         self.__update_forces(self.t)
 
+        #Store the initial state for the predictor
+        if len(self.history) == 0:
+            self.history.append((self.t,self.U0.vector().copy()))
+
         #Update the time
         self.t += self.dt
         info("\n t = %f"%self.t)
         
-        #Initial guess is previous time step value
-        self.U1.vector()[:] = self.U0.vector()
+        #Initial guess extrapolated from previous time step values
+        self.predict()
 
         #Apply initial guess BC (not homogeneous)
         for bc in self.fsibc.bcallU1_ini:
@@ -177,6 +205,10 @@ class FSINewtonSolver(ccom.CBCSolver):
             
             #Assign the new time step value to U0
             self.U0.vector()[:] = self.U1.vector()
+            if self.history.maxlen > 1:
+                self.history.append((self.t,self.U1.vector().copy()))
+            else:
+                self.history[0] = (self.t,self.U0.vector())
 
             #Plot if necessary
             if self.params["plot"]:
@@ -365,6 +397,22 @@ class FSINewtonSolver(ccom.CBCSolver):
         mf.assign_to_region(U0,zerovec,cellfunc,fluiddomains,V = self.spaces.V_S,exclude = fsi_dofs)
         return U0
         
+    def predict(self):
+        """
+        Set U1 to the Lagrange extrapolation of the stored states to the
+        current time (the previous value for the constant predictor)
+        """
+        times = [t for (t,U) in self.history]
+        self.U1.vector().zero()
+        for i,(t_i,U_i) in enumerate(self.history):
+            weight = 1.0
+            for j,t_j in enumerate(times):
+                if j != i:
+                    weight *= (self.t - t_j)/(t_i - t_j)
+            self.U1.vector().axpy(weight,U_i)
+        if len(self.history) > 1:
+            info("Extrapolating initial guess from %d time steps"%len(self.history))
+
     def time_discreteU(self,U1,U0,kn):
         Umid = tuple([(x+y)*0.5 for x,y in zip(U1,U0)])
         Udot = tuple([(x-y)*(1/kn) for x,y in zip(U1,U0)])  
@@ -172,3 +172,29 @@ def build_doftionary(V):
     return doftionary
 
 
+
+def dolfin_to_csr(A):
+    """
+    Return the DOLFIN matrix A as a scipy CSR matrix, built from the raw
+    CSR arrays of the matrix (uBLAS/MTL4 or PETSc through petsc4py)
+    """
+    from scipy.sparse import csr_matrix
+    try:
+        rows,cols,values = A.data()
+    except RuntimeError:
+        try:
+            import petsc4py
+        except ImportError:
+            raise Exception("Extracting a PETSc matrix requires petsc4py")
+        rows,cols,values = down_cast(A).mat().getValuesCSR()
+    return csr_matrix((values,cols,rows),shape = (A.size(0),A.size(1)))
+
+def csr_submatrix(A,dofs):
+    """
+    Return the submatrix of the DOLFIN or scipy sparse matrix A with rows
+    and columns dofs as a scipy CSR matrix, sliced from the raw CSR arrays
+    without a loop over the rows.
+    """
+    if not hasattr(A,"tocsr"):
+        A = dolfin_to_csr(A)
+    return A.tocsr()[dofs][:,dofs].tocsr()
@@ -5,11 +5,14 @@ __license__  = "GNU GPL Version 3 or any later version"
 # Last changed: 2012-04-10
 
 from dolfin import *
-from numpy import array, append
+from numpy import array, append, arange, bincount, cumsum, intersect1d, \
+    maximum, minimum, ones
+from scipy.sparse import csr_matrix
 from cbc.common import CBCProblem
 
 from fsisolver import FSISolver
 from parameters import default_parameters, read_parameters, store_parameters
+from storage import clear_globaldof_mappings, clear_data_cache
 import fsinewton.utils.interiorboundary as intb
 
 class FixedPointFSI(CBCProblem):
@@ -27,6 +30,7 @@ class FixedPointFSI(CBCProblem):
         # Store original mesh
         self._original_mesh = mesh
         self.Omega = None
+        self.cell_domains = None
 
     def solve(self, parameters=default_parameters()):
         "Solve and return computed solution (u_F, p_F, U_S, P_S, U_M, P_M)"
@@ -51,20 +55,38 @@ class FixedPointFSI(CBCProblem):
         # Solve
         return self.solver.solve(parameters)
 
-    def init_meshes(self, Omega, parameters):
-        "Create mappings between submeshes"
+    def init_meshes(self, Omega, parameters, parent=None):
+        """Create mappings between submeshes. If Omega was obtained by
+        refining the current mesh, pass that mesh as parent to inherit
+        its cell markers. Only the cell markers are inherited; the
+        submeshes, vertex and edge maps, interface dofs and facet
+        markers are always recomputed."""
 
         info("Extracting fluid and structure submeshes")
 
+        # Inherit cell markers from the parent mesh
+        parent_domains = None
+        if parent is not None:
+            parent_domains = _parent_cell_domains(Omega, parent, self.cell_domains)
+
         # Set global mesh
         self.Omega = Omega
 
-        # Create cell markers (0 = fluid, 1 = structure)
+        # Mappings and data stored for the previous mesh are no longer valid
+        clear_globaldof_mappings()
+        clear_data_cache()
+
+        # Create cell markers (0 = fluid, 1 = structure), inherited from
+        # the parent cells if Omega was obtained by refining the old mesh
         D = Omega.topology().dim()
         cell_domains = MeshFunction("uint", self.Omega, D)
-        cell_domains.set_all(0)
-        structure = self.structure()
-        structure.mark(cell_domains, 1)
+        if parent_domains is not None:
+            info("Inheriting cell markers from parent mesh")
+            cell_domains.array()[:] = parent_domains
+        else:
+            cell_domains.set_all(0)
+            structure = self.structure()
+            structure.mark(cell_domains, 1)
 
         # Extract submeshes for fluid and structure
         Omega_F = SubMesh(self.Omega, cell_domains, 0)
@@ -72,20 +94,22 @@ class FixedPointFSI(CBCProblem):
 
         info("Computing mappings between submeshes")
 
-        # Extract matching indices for fluid and structure
-        fluid_to_structure_v = compute_vertex_map(Omega_F, Omega_S)
-        fluid_to_structure_e = compute_edge_map(Omega_F, Omega_S)
+        # Extract matching vertex indices for fluid and structure (vertices
+        # present in both submeshes, matched by their parent vertex indices)
+        parent_vertices_F = Omega_F.data().mesh_function("parent_vertex_indices").array()
+        parent_vertices_S = Omega_S.data().mesh_function("parent_vertex_indices").array()
+        shared_vertices = intersect1d(parent_vertices_F, parent_vertices_S)
+        v_F = _inverse_map(parent_vertices_F, Omega.num_vertices())[shared_vertices]
+        v_S = _inverse_map(parent_vertices_S, Omega.num_vertices())[shared_vertices]
 
-        # Extract matching vertex indices for fluid and structure
-        v_F = array([i for i in fluid_to_structure_v.iterkeys()])
-        v_S = array([i for i in fluid_to_structure_v.itervalues()])
-
-        # Extract matching edge indices for fluid and structure
-        e_F = array([i for i in fluid_to_structure_e.iterkeys()])
-        e_S = array([i for i in fluid_to_structure_e.itervalues()])
+        # Extract matching edge indices for fluid and structure (only needed for P2)
+        structure_element_degree = parameters["structure_element_degree"]
+        if structure_element_degree == 2:
+            fluid_to_structure_e = compute_edge_map(Omega_F, Omega_S)
+            e_F = array([i for i in fluid_to_structure_e.iterkeys()])
+            e_S = array([i for i in fluid_to_structure_e.itervalues()])
 
         # Extract matching dofs for fluid and structure
-        structure_element_degree = parameters["structure_element_degree"]
         Nv_F = Omega_F.num_vertices()
         Nv_S = Omega_S.num_vertices()
         Ne_F = Omega_F.num_edges()
@@ -99,117 +123,39 @@ class FixedPointFSI(CBCProblem):
         else:
             error("Only know how to map dofs for P1 and P2 elements.")
 
-        # Extract map from vertices in Omega to vertices in Omega_F
-        vertex_map_to_fluid = {}
-        vertex_map_from_fluid = Omega_F.data().mesh_function("parent_vertex_indices")
-        for i in range(vertex_map_from_fluid.size()):
-            vertex_map_to_fluid[vertex_map_from_fluid[i]] = i
-
-        # Extract map from vertices in Omega to vertices in Omega_S
-        vertex_map_to_structure = {}
-        vertex_map_from_structure = Omega_S.data().mesh_function("parent_vertex_indices")
-        for i in range(vertex_map_from_structure.size()):
-            vertex_map_to_structure[vertex_map_from_structure[i]] = i
-
         info("Computing FSI boundary and orientation markers")
 
+        # Get facet-cell connectivity and cell markers for each facet
+        facet_vertices = _facet_vertices(Omega)
+        c0, c1 = _facet_cells(Omega)
+        structure_cells = cell_domains.array() == 1
+        s0 = structure_cells[c0]
+        s1 = structure_cells[c1]
+
+        # Markers:
+        #
+        # 0 = fluid
+        # 1 = structure
+        # 2 = FSI boundary
+        #
+        # The orientation is the cell on the fluid side for FSI facets and
+        # the first cell for all other facets. Boundary facets have c0 = c1.
+        on_fsi = s0 != s1
+        markers = s0.astype("uint32")
+        markers[on_fsi] = 2
+        orientation = c0.copy()
+        orientation[on_fsi & s0] = c1[on_fsi & s0]
+
         # Initialize FSI boundary and orientation markers on Omega
-        Omega.init(D - 1, D)
         fsi_boundary = FacetFunction("uint", Omega, D - 1)
-        fsi_boundary.set_all(0)
+        fsi_boundary.array()[:] = markers
         fsi_orientation = Omega.data().create_mesh_function("facet_orientation", D - 1)
-        fsi_orientation.set_all(0)
-
-        # Initialize FSI boundary on Omega_F
-        Omega_F.init(D - 1, D)
-        Omega_F.init(0, 1)
-        fsi_boundary_F = MeshFunction("uint", Omega_F, D - 1)
-        fsi_boundary_F.set_all(0)
-
-        # Initialize FSI boundary on Omega_S
-        Omega_S.init(D - 1, D)
-        Omega_S.init(0, 1)
-        fsi_boundary_S = MeshFunction("uint", Omega_S, D - 1)
-        fsi_boundary_S.set_all(0)
-
-        # Compute FSI boundary and orientation markers on Omega
-        for facet in facets(Omega):
-
-            # Handle facets on the boundary
-            cells = facet.entities(D)
-            if len(cells) == 1:
-
-                # Create cell and midpoint
-                c = cells[0]
-                cell = Cell(Omega, c)
-                p = cell.midpoint()
-
-                # Check whether point is inside structure domain
-                facet_index = facet.index()
-                if structure.inside(p0, True):
-
-                    # On structure boundary
-                    fsi_boundary[facet_index] = 1
-                    fsi_orientation[facet_index] = c
-
-                else:
-
-                    # On fluid boundary
-                    fsi_boundary[facet_index] = 0
-                    fsi_orientation[facet_index] = c
-
-                continue
-
-            # Sanity check
-            if len(cells) != 2:
-                error("Strange, expecting one or two facets!")
-
-            # Create the two cells
-            c0, c1 = cells
-            cell0 = Cell(Omega, c0)
-            cell1 = Cell(Omega, c1)
-
-            # Get the two midpoints
-            p0 = cell0.midpoint()
-            p1 = cell1.midpoint()
-
-            # Check if the points are inside
-            p0_inside = structure.inside(p0, False)
-            p1_inside = structure.inside(p1, False)
-
-            # Just set c0, will be set only for FSI facets below
-            fsi_orientation[facet.index()] = c0
-
-            # Markers:
-            #
-            # 0 = fluid
-            # 1 = structure
-            # 2 = FSI boundary
-
-            # Look for points where exactly one is inside the structure
-            facet_index = facet.index()
-            if p0_inside and not p1_inside:
-
-                # On FSI boundary
-                fsi_boundary[facet_index] = 2
-                fsi_orientation[facet_index] = c1
-                fsi_boundary_F[_map_to_facet(facet_index, Omega, Omega_F, vertex_map_to_fluid)] = 2
-                fsi_boundary_S[_map_to_facet(facet_index, Omega, Omega_S, vertex_map_to_structure)] = 2
-            elif p1_inside and not p0_inside:
-
-                # On FSI boundary
-                fsi_boundary[facet_index] = 2
-                fsi_orientation[facet_index] = c0
-                fsi_boundary_F[_map_to_facet(facet_index, Omega, Omega_F, vertex_map_to_fluid)] = 2
-                fsi_boundary_S[_map_to_facet(facet_index, Omega, Omega_S, vertex_map_to_structure)] = 2
-            elif p0_inside and p1_inside:
-
-                # Inside structure domain
-                fsi_boundary[facet_index] = 1
-            else:
-
-                # Inside fluid domain
-                fsi_boundary[facet_index] = 0
+        fsi_orientation.array()[:] = orientation
+
+        # Initialize FSI boundary on submeshes
+        fsi_facets = facet_vertices[on_fsi]
+        fsi_boundary_F = _submesh_facet_markers(Omega_F, fsi_facets, 2)
+        fsi_boundary_S = _submesh_facet_markers(Omega_S, fsi_facets, 2)
 
         # Initialize global edge indices (used in read_primal_data)
         init_parent_edge_indices(Omega_F, Omega)
@@ -219,8 +165,8 @@ class FixedPointFSI(CBCProblem):
         self.Omega_F = Omega_F
         self.Omega_S = Omega_S
         self.cell_domains = cell_domains
-        self.fdofs = fdofs
-        self.sdofs = sdofs
+        self.fdofs = fdofs.astype("uint32")
+        self.sdofs = sdofs.astype("uint32")
         self.fsi_boundary = fsi_boundary
         self.fsi_orientation = fsi_orientation
         self.fsi_boundary_F = fsi_boundary_F
@@ -239,18 +185,12 @@ class FixedPointFSI(CBCProblem):
         return self.Omega_S
 
     def add_f2s(self, xs, xf):
-        "Compute xs += xf for corresponding indices"
-        xs_array = xs.array()
-        xf_array = xf.array()
-        xs_array[self.sdofs] += xf_array[self.fdofs]
-        xs[:] = xs_array
+        "Compute xs += xf for corresponding indices (only touching interface dofs)"
+        xs[self.sdofs] = xs[self.sdofs] + xf[self.fdofs]
 
     def add_s2f(self, xf, xs):
-        "Compute xf += xs for corresponding indices"
-        xf_array = xf.array()
-        xs_array = xs.array()
-        xf_array[self.fdofs] += xs_array[self.sdofs]
-        xf[:] = xf_array
+        "Compute xf += xs for corresponding indices (only touching interface dofs)"
+        xf[self.fdofs] = xf[self.fdofs] + xs[self.sdofs]
 
     #--- Optional functions ---
 
@@ -276,30 +216,89 @@ class FixedPointFSI(CBCProblem):
     def evaluate_functional(self, u_F, p_F, U_S, P_S, U_M, dx_F, dx_S, dx_M):
         return inner(u_F,u_F)*dx
 
-def _map_to_facet(facet_index, Omega, Omega_X, vertex_map):
-    "Map facet index in Omega to facet index in Omega_X"
-
-    # Get the two vertices in Omega
-    facet = Facet(Omega, facet_index)
-    v0 = facet.entities(0)[0]
-    v1 = facet.entities(0)[1]
-
-    # Get the two vertices in Omega_X
-    v0 = Vertex(Omega_X, vertex_map[v0])
-    v1 = Vertex(Omega_X, vertex_map[v1])
-
-    # Get the facets of the two vertices in Omega_X
-    f0 = v0.entities(1)
-    f1 = v1.entities(1)
-
-    # Get the common facet index
-    common_facets = set(f0).intersection(set(f1))
+def _parent_cell_domains(mesh, parent, parent_domains):
+    """Return cell markers inherited from parent_domains through the
+    parent cells stored by refine (None if not available or if the
+    parent cells do not match the parent mesh and its markers)"""
+    if parent_domains is None or \
+       not parent_domains.size() == parent.num_cells():
+        return None
+    parent_cell = mesh.data().mesh_function("parent_cell")
+    if parent_cell is None:
+        return None
 
-    # Check that we get exactly one facet
-    if not len(common_facets) == 1:
-        error("Unable to find facet in fluid mesh.")
+    # Each cell of the parent mesh is refined into at least one cell
+    parent_cell = parent_cell.array()
+    if not parent_cell.size == mesh.num_cells() or \
+       parent_cell.max() >= parent.num_cells() or \
+       bincount(parent_cell, minlength=parent.num_cells()).min() < 1:
+        return None
 
-    return int(list(common_facets)[0])
+    return parent_domains.array()[parent_cell]
+
+def _inverse_map(indices, size):
+    "Return inverse of injective map given by array of indices (-1 if not mapped)"
+    inverse = -ones(size, dtype="int64")
+    inverse[indices] = arange(len(indices))
+    return inverse
+
+def _facet_vertices(mesh):
+    "Return array of vertex indices for all facets of mesh"
+    D = mesh.topology().dim()
+    mesh.init(D - 1, 0)
+    vertices = mesh.topology()(D - 1, 0)()
+    return vertices.reshape((mesh.size(D - 1), D)).astype("int64")
+
+def _facet_cells(mesh):
+    """Return the two cells c0 < c1 incident to each facet (c0 = c1 on
+    the boundary), read from the facet-cell connectivity"""
+
+    # Number of cells for each facet, counted from the cell-facet
+    # connectivity since the facet-cell connectivity has variable size
+    D = mesh.topology().dim()
+    mesh.init(D - 1, D)
+    cells = mesh.topology()(D - 1, D)().astype("int64")
+    counts = bincount(mesh.topology()(D, D - 1)().astype("int64"),
+                      minlength=mesh.size(D - 1))
+    if counts.max() > 2 or counts.min() < 1:
+        error("Strange, expecting one or two cells for each facet!")
+
+    # First and last cell for each facet
+    first = cumsum(counts) - counts
+    c0 = cells[first]
+    c1 = cells[first + counts - 1]
+
+    return minimum(c0, c1), maximum(c0, c1)
+
+def _vertex_incidence(facet_vertices, num_vertices):
+    "Return sparse facet-vertex incidence matrix"
+    num_facets, n = facet_vertices.shape
+    return csr_matrix((ones(num_facets*n), facet_vertices.ravel(),
+                       arange(0, num_facets*n + 1, n)),
+                      shape=(num_facets, num_vertices))
+
+def _submesh_facet_markers(submesh, facet_vertices, value):
+    """Create facet markers on submesh, marking the given facets
+    (vertex indices in the parent mesh) with value"""
+    D = submesh.topology().dim()
+    markers = MeshFunction("uint", submesh, D - 1)
+    markers.set_all(0)
+    if len(facet_vertices) == 0:
+        return markers
+
+    # Facets of the submesh and the given facets match if they share
+    # all D vertices (counted by a sparse incidence product)
+    parent_vertices = submesh.data().mesh_function("parent_vertex_indices").array()
+    submesh_facets = parent_vertices[_facet_vertices(submesh)]
+    num_vertices = max(submesh_facets.max(), facet_vertices.max()) + 1
+    shared = (_vertex_incidence(submesh_facets, num_vertices) *
+              _vertex_incidence(facet_vertices, num_vertices).T).tocoo()
+    matching = shared.row[shared.data == D]
+    if not len(matching) == len(facet_vertices):
+        error("Unable to find facet in mesh.")
+    markers.array()[matching] = value
+
+    return markers
 
 class NewtonFSI():
     """Basic problem class for Newton's method FSI"""
@@ -97,7 +97,8 @@ class FSISolver(CBCSolver):
                 if parameters["uniform_mesh"]:
                     info_red("Refining mesh uniformly")
                     refined_mesh = refine(self.problem.mesh())
-                    self.problem.init_meshes(refined_mesh, parameters)
+                    self.problem.init_meshes(refined_mesh, parameters,
+                                             parent=self.problem.mesh())
                 elif E_h <= mesh_tolerance:
                     info_blue("Freezing current mesh: E_h = %g <= TOL_h = %g" % (E_h, mesh_tolerance))
                     info_blue("Starting final round!")
@@ -106,7 +107,8 @@ class FSISolver(CBCSolver):
                 else:
                     info_red("Refining mesh adaptively")
                     refined_mesh = refine_mesh(self.problem, self.problem.mesh(), indicators, parameters)
-                    self.problem.init_meshes(refined_mesh, parameters)
+                    self.problem.init_meshes(refined_mesh, parameters,
+                                             parent=self.problem.mesh())
                 end()
 
                 # Time step adaptivity
@@ -15,10 +15,12 @@ def create_dual_forms(Omega_F, Omega_S, k, problem,
                       Z_F,  Y_F,  X_F,  Z_S,  Y_S,  Z_M,  Y_M,
                       Z_F0, Y_F0, X_F0, Z_S0, Y_S0, Z_M0, Y_M0,
                       U_F0, P_F0, U_S0, P_S0, U_M0,
-                      U_F1, P_F1, U_S1, P_S1, U_M1, parameters):
+                      U_F1, P_F1, U_S1, P_S1, U_M1, parameters, buffered=False):
     """
     Return bilinear and linear forms for a time step
     method - FE is forward Euler, BE is backward Euler, CG1 is midpoint rule
+    buffered - also return the bilinear form which does not depend on the
+               primal solution separately (not included in the first form)
     """
 
     # Choose method here
@@ -105,15 +107,22 @@ def create_dual_forms(Omega_F, Omega_S, k, problem,
                                  forces = forces,
                                  normals = normals,
                                  params = parameters["FSINewtonSolver"].to_dict())
-    #Add back the buffered forms
-    A_system += A_buff
-
-                              # Define goal funtional
+    # Define goal funtional
     goal_functional = problem.evaluate_functional(v_F, q_F, v_S, q_S, v_M,
                                                   measures["fluidneumannbound"][0],
                                                   measures["structure"][0],
                                                   measures["fluid"][0])
 
+    # Keep the buffered forms separate (they only depend on k)
+    if buffered:
+        A = lhs(A_system)
+        L = rhs(A_system + A_buff) + goal_functional
+        info_blue("Dual forms created")
+        return A, L, lhs(A_buff)
+
+    #Add back the buffered forms
+    A_system += A_buff
+
     # Define the dual rhs and lhs
     A = lhs(A_system)
     L = rhs(A_system) + goal_functional
@@ -30,6 +30,13 @@ def default_parameters():
     p.add("uniform_mesh", False)
     p.add("dorfler_marking", True)
     p.add("global_storage", False)
+    p.add("storage_format", "timeseries") # timeseries or binary
+    p.add("storage_cache_size", 256)      # MB of primal/dual data kept in memory
+    p.add("prefetch_levels", 0)           # time levels read ahead in background (0 = off, binary only)
+    p.add("write_queue_depth", 0)         # pending writes of primal data (0 = synchronous, binary only)
+    p.add("fused_assembly", False)        # assemble error residuals in a single pass
+    p.add("num_estimate_processes", 1)    # processes for error estimation over time intervals
+    p.add("indicator_format", "pvd")      # pvd or binary (one .npz file per level)
     p.add("structure_element_degree", 1)
     p.add("mesh_element_degree", 1)
     p.add("max_num_refinements", 100)
@@ -39,10 +46,16 @@ def default_parameters():
     p.add("num_initial_refinements", 0)
     p.add("maximum_iterations", 1000)
     p.add("num_smoothings", 50)
+    p.add("coupling_acceleration", "none") # none, aitken or iqn-ils (fixpoint solver)
+    p.add("coupling_relaxation", 0.5)      # initial relaxation factor
+    p.add("coupling_reuse", 0)             # time steps of secant data reused by iqn-ils
+    p.add("fsi_convergence_norm", "full")  # full or interface (fixpoint solver)
+    p.add("save_fsi_residuals", False)     # save increments of each FSI iteration
     p.add("w_h", 0.45)
     p.add("w_k", 0.45)
     p.add("w_c", 0.1)
     p.add("marking_fraction", 0.5)
+    p.add("marking_strategy", "dorfler") # dorfler, fixed_fraction or equidistribution
     p.add("refinement_algorithm", "regular_cut")
     p.add("crossed_mesh", False)
     p.add("use_exact_solution", False)
@@ -56,6 +69,10 @@ def default_parameters():
     q = Parameters("dualsolver")
     q.add("timestepping","FE") #CG1 BE or FE
     q.add("fluid_domain_time_discretization","end-point")
+    q.add("buffer_matrix", False)       # assemble time step dependent part only once per dt
+    q.add("reuse_factorization", False) # precondition with factorization from previous step
+    q.add("reuse_tolerance", 1e-10)     # relative residual for reused factorization
+    q.add("reuse_iterations", 10)       # max GMRES iterations before refactorizing
     p.add(q)
     return p
 
@@ -132,11 +149,25 @@ def default_fsinewtonsolver_parameters():
     opt.add("reuse_jacobian",True)
     opt.add("simplify_jacobian",False)
     opt.add("max_reuse_jacobian",30)
+    opt.add("reuse_policy","fixed") # "fixed" or "adaptive" (measured rate and cost)
     opt.add("reduce_quadrature",0) #0 means no reduction, i >0 means reduce to order i.
     p.add(opt)
     
     p.add("jacobian","buff") # "manual", "auto", "buff"
+    p.add("linear_solver","lu") # "lu", "reduced" (sparse LU on useful dofs) or "krylov"
+
+    #GMRES with block preconditioner, used if linear_solver = "krylov"
+    #(scipy based, for small problems in serial only)
+    kr = Parameters("krylov")
+    kr.add("preconditioner","ilu") # "ilu", "amg" (needs pyamg) or "lu" for each block
+    kr.add("initial_forcing",0.5)
+    kr.add("maximum_forcing",0.9)
+    kr.add("maximum_iterations",500)
+    kr.add("restart",100)
+    p.add(kr)
     p.add("newtonitrmax",100)
+    p.add("globalization","none") # "none", "armijo" (line search) or "damped"
+    p.add("predictor","constant") # initial guess: "constant", "linear" or "quadratic" extrapolation
     
     ##################################
     #This parameter is only necessary for the problem class NewtonFSI
@@ -16,6 +16,7 @@ from cbc.common.utils import timestep_range
 from subproblems import *
 from adaptivity import *
 from storage import *
+from coupling import create_coupling_accelerator
 import sys
 from cbc.swing.fsinewton.solver.solver_fsinewton import FSINewtonSolver
 import fsinewton.utils.misc_func as mf
@@ -51,12 +52,15 @@ class PrimalSolver(object):
                      File("%s/pvd/level_%d/P_S.pvd" % (parameters["output_directory"], level)),
                      File("%s/pvd/level_%d/U_M.pvd" % (parameters["output_directory"], level)))
 
+        # Create queue for writing solution in the background
+        writer = create_writer(parameters)
+
         # Create time series for storing solution
-        primal_series = create_primal_series(parameters)
+        primal_series = create_primal_series(parameters, level)
 
         # Create time series for dual solution
         if level > 0:
-            dual_series = create_dual_series(parameters)
+            dual_series = create_dual_series(parameters, level - 1)
         else:
             dual_series = None
 
@@ -74,6 +78,9 @@ class PrimalSolver(object):
         S = StructureProblem(problem, parameters)
         M = MeshProblem(problem, parameters)
 
+        # Create accelerator for fixed point iteration
+        accelerator = create_coupling_accelerator(parameters)
+
         # Get solution values
         u_F0, u_F1, p_F0, p_F1 = F.solution_values()
         U_M0, U_M1 = M.solution_values()
@@ -92,7 +99,7 @@ class PrimalSolver(object):
         U = extract_solution(F, S, M)
         if save_solution:
             _save_solution(U, files)
-            write_primal_data(U, 0, primal_series)
+            write_primal_data(U, 0, primal_series, writer)
 
         # Initialize adaptive data
         init_adaptive_data(problem, parameters)
@@ -124,99 +131,113 @@ class PrimalSolver(object):
             #initialize the solve settings
             fsinewtonsolver.prepare_solve()
             
-        #def solve_primal()
-        while True:
-
-            # Display progress
-            info("")
-            info("-"*80)
-            begin("* Starting new time step")
-            info_blue("  * t = %g (T = %g, dt = %g)" % (t1, T, dt))
-
-            # Update of user problem
-            problem.update(t0, t1, dt)
-
-            # Compute tolerance for FSI iterations
-            itertol = compute_itertol(problem, w_c, TOL, dt, t1, parameters)
-            if parameters["primal_solver"] == "Newton":
-                #Newtonsolver has it's own timings
-                assert save_solution,"Parameter save_solution must be true to use the Newton Solver"
-                U_S1,U_S0,P_S1,increment,numiter = newton_solve(F,S,M,U_S0,dt,parameters,itertol,problem,fsinewtonsolver)
-            elif parameters["primal_solver"] == "fixpoint":
-                timings.startnext("FixpointSolve")
-                U_S0,U_S1,P_S1,increment,numiter = fixpoint_solve(F,S,U_S0,M,dt,t1,parameters,itertol,problem)
-                timings.stop("FixpointSolve")
-            else:
-                raise Exception("Only 'fixpoint' and 'Newton' are possible values \
-                                for the parameter 'primal_solver'")
-            self.g_numiter = numiter
-        #####################################################
-        #The primal solve worked so now go to post processing
-        #####################################################
-        #def postprocessing():
-            # Plot solution
-            if plot_solution:
-                _plot_solution(u_F1, p_F1, U_S0, U_M1)
-            if problem.exact_solution() is not None:
-                update_exactsol(u_F1,p_F1,U_S1,U_M1,F,problem,t1)      
-
-            info("")
-            info_green("Increment = %g (tolerance = %g), converged after %d iterations" % (increment, itertol, numiter + 1))
-            info("")
-            end()
-
-            # Saving number of FSI iterations
-            save_no_FSI_iter(t1, numiter + 1, parameters)
-
-            # Evaluate user goal functional
-            goal_functional = assemble(problem.evaluate_functional(u_F1, p_F1, U_S1, P_S1, U_M1, dx, dx, dx))
-
-            # Integrate goal functional
-            integrated_goal_functional += 0.5 * dt * (old_goal_functional + goal_functional)
-            old_goal_functional = goal_functional
-
-            # Save goal functional
-            save_goal_functional(t1, goal_functional, integrated_goal_functional, parameters)
-
-
-            # Save solution and time series to file
-            U = extract_solution(F, S, M)
-            if save_solution:
-                _save_solution(U, files)
-                write_primal_data(U, t1, primal_series)
-
-            # Move to next time step
-            F.update(t1)
-            S.update()
-            M.update(t1)
-
-            # Update time step counter
-            timestep_counter += 1
-
-            # FIXME: This should be done automatically by the solver
-            F.update_extra()
-
-            # Check if we have reached the end time
-            if at_end:
+        # Stop background writing on errors
+        try:
+            #def solve_primal()
+            while True:
+
+                # Display progress
+                info("")
+                info("-"*80)
+                begin("* Starting new time step")
+                info_blue("  * t = %g (T = %g, dt = %g)" % (t1, T, dt))
+
+                # Update of user problem
+                problem.update(t0, t1, dt)
+
+                # Compute tolerance for FSI iterations
+                itertol = compute_itertol(problem, w_c, TOL, dt, t1, parameters)
+                if parameters["primal_solver"] == "Newton":
+                    #Newtonsolver has it's own timings
+                    assert save_solution,"Parameter save_solution must be true to use the Newton Solver"
+                    U_S1,U_S0,P_S1,increment,numiter = newton_solve(F,S,M,U_S0,dt,parameters,itertol,problem,fsinewtonsolver)
+                elif parameters["primal_solver"] == "fixpoint":
+                    timings.startnext("FixpointSolve")
+                    residuals = [] if parameters["save_fsi_residuals"] else None
+                    U_S0,U_S1,P_S1,increment,numiter = fixpoint_solve(F,S,U_S0,M,dt,t1,parameters,itertol,problem,accelerator,residuals)
+                    if residuals is not None:
+                        save_FSI_residuals(t1, residuals, parameters, writer)
+                    timings.stop("FixpointSolve")
+                else:
+                    raise Exception("Only 'fixpoint' and 'Newton' are possible values \
+                                    for the parameter 'primal_solver'")
+                self.g_numiter = numiter
+            #####################################################
+            #The primal solve worked so now go to post processing
+            #####################################################
+            #def postprocessing():
+                # Plot solution
+                if plot_solution:
+                    _plot_solution(u_F1, p_F1, U_S0, U_M1)
+                if problem.exact_solution() is not None:
+                    update_exactsol(u_F1,p_F1,U_S1,U_M1,F,problem,t1)      
+
+                info("")
+                info_green("Increment = %g (tolerance = %g), converged after %d iterations" % (increment, itertol, numiter + 1))
                 info("")
-                info_green("Finished time-stepping")
-                save_dofs(num_dofs_FSM, timestep_counter, parameters)
                 end()
-                break
 
-            # Use constant time step
-            if uniform_timestep:
-                t0 = t1
-                t1 = min(t1 + dt, T)
-                dt = t1 - t0
-                at_end = abs(t1 - T) / T < 100.0*DOLFIN_EPS
+                # Saving number of FSI iterations
+                save_no_FSI_iter(t1, numiter + 1, parameters, writer)
+
+                # Evaluate user goal functional
+                goal_functional = assemble(problem.evaluate_functional(u_F1, p_F1, U_S1, P_S1, U_M1, dx, dx, dx))
+
+                # Integrate goal functional
+                integrated_goal_functional += 0.5 * dt * (old_goal_functional + goal_functional)
+                old_goal_functional = goal_functional
+
+                # Save goal functional
+                save_goal_functional(t1, goal_functional, integrated_goal_functional, parameters,
+                                     writer)
+
+
+                # Save solution and time series to file
+                U = extract_solution(F, S, M)
+                if save_solution:
+                    _save_solution(U, files)
+                    write_primal_data(U, t1, primal_series, writer)
+
+                # Move to next time step
+                F.update(t1)
+                S.update()
+                M.update(t1)
+
+                # Update time step counter
+                timestep_counter += 1
+
+                # FIXME: This should be done automatically by the solver
+                F.update_extra()
+
+                # Check if we have reached the end time
+                if at_end:
+                    info("")
+                    info_green("Finished time-stepping")
+                    save_dofs(num_dofs_FSM, timestep_counter, parameters)
+                    end()
+                    break
+
+                # Use constant time step
+                if uniform_timestep:
+                    t0 = t1
+                    t1 = min(t1 + dt, T)
+                    dt = t1 - t0
+                    at_end = abs(t1 - T) / T < 100.0*DOLFIN_EPS
+
+                # Compute new adaptive time step
+                else:
+                    writer.flush()
+                    Rk = compute_time_residual(primal_series, dual_series, t0, t1, problem, parameters)
+                    (dt, at_end) = compute_time_step(problem, Rk, TOL, dt, t1, T, w_k, parameters)
+                    t0 = t1
+                    t1 = t1 + dt
+        except:
+            writer.close(check=False)
+            raise
+
+        # Wait for remaining output to be written
+        writer.close()
 
-            # Compute new adaptive time step
-            else:
-                Rk = compute_time_residual(primal_series, dual_series, t0, t1, problem, parameters)
-                (dt, at_end) = compute_time_step(problem, Rk, TOL, dt, t1, T, w_k, parameters)
-                t0 = t1
-                t1 = t1 + dt
         #End of Time loop
         #Call post processing for the Newton Solver if necessary.
         if parameters["primal_solver"] == "Newton":
@@ -242,18 +263,37 @@ def _plot_solution(u_F, p_F, U_S, U_M):
 
 
 def _save_solution(U, files):
-    "Save solution to VTK"
+    """Save solution to VTK. This is always done on the main thread
+    since writing VTK files calls DOLFIN."""
     [files[i] << U[i] for i in range(5)]
 
-def fixpoint_solve(F,S,U_S0,M,dt,t1,parameters,itertol,problem):
-    """Return the value at the next time step using fixpoint iteration"""
+def fixpoint_solve(F,S,U_S0,M,dt,t1,parameters,itertol,problem,accelerator=None,history=None):
+    """Return the value at the next time step using fixpoint iteration,
+    optionally accelerated on the interface displacement. The increment
+    of each iteration is appended to history if given."""
     # Get Parameters
     maxiter = parameters["maximum_iterations"]
     num_smoothings = parameters["num_smoothings"]
+    convergence_norm = parameters["fsi_convergence_norm"]
+
+    # Dofs used for checking convergence
+    if convergence_norm == "interface":
+        dofs = problem.sdofs
+    elif convergence_norm == "full":
+        dofs = None
+    else:
+        error("Unknown FSI convergence norm: %s" % convergence_norm)
+
+    # Buffers for previous and current displacement (swapped by reference)
+    buffers = S.displacement_buffers(U_S0, dofs)
     
     # Get solution values
     u_F0, u_F1, p_F0, p_F1 = F.solution_values()
     U_M0, U_M1 = M.solution_values()
+
+    # Reset accelerator for new time step
+    if accelerator is not None:
+        accelerator.new_time_step()
     
     # Fixed point iteration on FSI problem
     for numiter in range(maxiter):
@@ -279,7 +319,15 @@ def fixpoint_solve(F,S,U_S0,M,dt,t1,parameters,itertol,problem):
 
         # Transfer structure displacement to fluid mesh
         begin("* Transferring structure displacement to mesh (S --> M)")
-        M.update_structure_displacement(U_S1)
+        increment = buffers.update(U_S1)
+        if accelerator is None:
+            M.update_structure_displacement(U_S1)
+        else:
+            if dofs is problem.sdofs:
+                x = buffers.current
+            else:
+                x = U_S1.vector()[problem.sdofs].array()
+            M.update_interface_displacement(accelerator.update(x))
         end()
 
         # Solve mesh equation
@@ -292,15 +340,15 @@ def fixpoint_solve(F,S,U_S0,M,dt,t1,parameters,itertol,problem):
         F.update_mesh_displacement(U_M1, dt, num_smoothings)
         end()
 
-        # Compute increment of displacement vector
-        U_S0.vector().axpy(-1, U_S1.vector())
-        increment = norm(U_S0.vector())
-        U_S0.vector()[:] = U_S1.vector()[:]
+        # Record increment of displacement vector
+        if history is not None:
+            history.append(increment)
 
         # Check convergence
         if increment < itertol and numiter > 2:            
             info_green("Increment is %g. Maybe plotting" % increment)
             print "numiter = ",numiter
+            U_S0.vector()[:] = U_S1.vector()
             return (U_S0, U_S1, P_S1, increment,numiter)
 
         # Check if we have reached the maximum number of iterations
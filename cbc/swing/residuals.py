@@ -7,6 +7,7 @@ __license__  = "GNU GPL Version 3 or any later version"
 # Last changed: 2012-05-04
 
 from dolfin import *
+import ufl
 
 from cbc.twist import PiolaTransform
 from operators import Sigma_F as _Sigma_F
@@ -194,3 +195,35 @@ def strong_residuals(U0, U1, U, Z, EZ, w, kn, problem):
     R_M2 = w('+')*inner(EY_M - Y_M, U_M - U_S)('+')*d_FSI # this should be zero
 
     return (R_F0, R_F1, R_F2, R_F3), (R_S0, R_S1, R_S2, R_S3), (R_M0, R_M1, R_M2)
+
+def fused_residuals(mesh, scalar_forms, indicator_forms, w):
+    """Combine scalar residuals and residuals for error indicators
+    (linear in the piecewise constant test function w) into a single
+    form which may be assembled in one pass over the mesh. The scalar
+    values are stored in the first len(scalar_forms) entries of the
+    assembled vector, followed by one block of num_cells values for
+    each indicator form."""
+
+    # Create test functions for combined form
+    R = VectorFunctionSpace(mesh, "R", 0, dim=len(scalar_forms))
+    DG = VectorFunctionSpace(mesh, "DG", 0, dim=len(indicator_forms))
+    r, dg = TestFunctions(MixedFunctionSpace([R, DG]))
+
+    # Weight scalar residuals by global test functions
+    forms = [_weighted_form(form, r[i]) for (i, form) in enumerate(scalar_forms)]
+
+    # Replace test function for indicators
+    forms += [replace(form, {w: dg[i]}) for (i, form) in enumerate(indicator_forms)]
+
+    return reduce(lambda a, b: a + b, forms)
+
+def _weighted_form(form, weight):
+    "Return form with integrands multiplied by weight"
+    integrals = []
+    for integral in form.integrals():
+        if integral.measure().domain_type() == ufl.Measure.INTERIOR_FACET:
+            integrand = integral.integrand()*weight('+')
+        else:
+            integrand = integral.integrand()*weight
+        integrals.append(integral.reconstruct(integrand=integrand))
+    return ufl.Form(integrals)
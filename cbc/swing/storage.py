@@ -14,12 +14,23 @@ __license__  = "GNU GPL Version 3 or any later version"
 
 # Last changed: 2012-05-03
 
-from numpy import append
+import os
+import Queue
+import threading
+import numpy
+from collections import OrderedDict
+from numpy import concatenate
 from dolfin import *
 
-def create_primal_series(parameters):
+def create_primal_series(parameters, level=0):
     "Create time series for primal solution"
     info("Creating primal time series.")
+    _data_cache.max_bytes = parameters["storage_cache_size"]*1024*1024
+    if parameters["storage_format"] == "binary":
+        return BinaryTimeSeries(_series_name("primal_%d" % level, parameters), 5)
+    elif not parameters["storage_format"] == "timeseries":
+        error("Unknown storage format: %s" % parameters["storage_format"])
+
     if parameters["global_storage"]:
         u_F = TimeSeries("bin/u_F")
         p_F = TimeSeries("bin/p_F")
@@ -35,16 +46,295 @@ def create_primal_series(parameters):
 
     return (u_F, p_F, U_S, P_S, U_M)
 
-def create_dual_series(parameters):
+def create_dual_series(parameters, level=0):
     "Create time series for dual solution"
     info("Creating dual time series.")
+    _data_cache.max_bytes = parameters["storage_cache_size"]*1024*1024
+    if parameters["storage_format"] == "binary":
+        return BinaryTimeSeries(_series_name("dual_%d" % level, parameters), 1)
+    elif not parameters["storage_format"] == "timeseries":
+        error("Unknown storage format: %s" % parameters["storage_format"])
+
     if parameters["global_storage"]:
         return TimeSeries("bin/Z")
     else:
         return TimeSeries("%s/bin/Z" % parameters["output_directory"])
 
+def _series_name(name, parameters):
+    "Return file name (without suffix) for binary time series"
+    if parameters["global_storage"]:
+        return "bin/%s" % name
+    else:
+        return "%s/bin/%s" % (parameters["output_directory"], name)
+
+class BinaryTimeSeries(object):
+    """Time series storing all fields for one time level as a single
+    contiguous record of doubles in one file. An index file maps each
+    time to the byte offset of its record and the sizes of the fields,
+    and the data file is memory-mapped for reading, so retrieving a
+    time level amounts to a single lookup.
+
+    The first call to store() on a series truncates the file, so each
+    refinement level writes a new file."""
+
+    def __init__(self, filename, num_fields):
+        "Create binary time series with given file name (without suffix)"
+        self.filename = filename + ".bin"
+        self.indexname = filename + ".idx"
+        self.num_fields = num_fields
+        self._writing = False
+        self._index = None
+        self._map = None
+
+    def store(self, vectors, t):
+        "Store vectors (one for each field) at given time"
+        self.store_values([v.array() for v in vectors], t)
+
+    def store_values(self, values, t):
+        """Store arrays (one for each field) at given time. This only
+        uses numpy and file I/O, so it may be called from a thread."""
+
+        # Start new file on first write
+        if not self._writing:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            open(self.filename, "wb").close()
+            open(self.indexname, "w").close()
+            self._writing = True
+            self._index = ([], [], [])
+            self._map = None
+
+        # Pack all fields into one record
+        values = [numpy.asarray(x, dtype=numpy.float64) for x in values]
+        sizes = [len(v) for v in values]
+        record = concatenate(values)
+
+        # Append record to data file
+        offset = os.path.getsize(self.filename)
+        f = open(self.filename, "ab")
+        record.tofile(f)
+        f.close()
+
+        # Append entry to index
+        f = open(self.indexname, "a")
+        f.write("%.16e %d %s\n" % (t, offset, " ".join(str(n) for n in sizes)))
+        f.close()
+        times, offsets, all_sizes = self._index
+        times.append(t)
+        offsets.append(offset)
+        all_sizes.append(sizes)
+
+    def retrieve(self, t):
+        "Retrieve values (one array for each field) at given time"
+        values = self.retrieve_values(t)
+        if values is None:
+            error("No data stored at t = %.16e in %s." % (t, self.filename))
+        return values
+
+    def retrieve_values(self, t):
+        """Retrieve values at given time (None if missing). This only
+        uses numpy and file I/O, so it may be called from a thread."""
+
+        # Find record
+        times, offsets, sizes = self._read_index()
+        i = self._find(times, t)
+        if i is None:
+            return None
+
+        # Map data file (remap if it has grown since last read)
+        itemsize = numpy.dtype(numpy.float64).itemsize
+        begin = offsets[i] / itemsize
+        end = begin + sum(sizes[i])
+        if self._map is None or len(self._map) < end:
+            self._map = numpy.memmap(self.filename, dtype=numpy.float64, mode="r")
+
+        # Extract fields from record
+        values = []
+        for n in sizes[i]:
+            values.append(numpy.array(self._map[begin:begin + n]))
+            begin += n
+
+        return values
+
+    def vector_times(self):
+        "Return array of times for stored records"
+        return numpy.array(self._read_index()[0])
+
+    def _read_index(self):
+        "Read index from file (only first time when reading)"
+        if self._index is None:
+            times, offsets, sizes = [], [], []
+            if os.path.exists(self.indexname):
+                for line in open(self.indexname):
+                    words = line.split()
+                    if len(words) == 0: continue
+                    times.append(float(words[0]))
+                    offsets.append(int(words[1]))
+                    sizes.append([int(n) for n in words[2:]])
+            self._index = (times, offsets, sizes)
+        return self._index
+
+    def _find(self, times, t):
+        "Find index of given time (None if missing)"
+        if len(times) == 0:
+            return None
+        i = numpy.argmin(abs(numpy.array(times) - t))
+        if abs(times[i] - t) > 100.0*DOLFIN_EPS*max(1.0, abs(t)):
+            return None
+        return i
+
+class DataCache(object):
+    """Least recently used cache of decoded primal and dual values,
+    keyed by (field, t) and bounded by a total size in bytes. This
+    avoids reading the same time level from disk several times when
+    the dual solver, the error estimation and the time residual all
+    walk the same time series."""
+
+    def __init__(self, max_bytes):
+        "Create cache holding at most max_bytes bytes"
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, field, t):
+        "Return cached values for field at time t (None if missing)"
+        key = (field, _time_key(t))
+        with self._lock:
+            values = self._values.pop(key, None)
+            if values is not None:
+                self._values[key] = values
+        return values
+
+    def put(self, field, t, values):
+        "Insert values for field at time t"
+        key = (field, _time_key(t))
+        with self._lock:
+            if key in self._values:
+                self.num_bytes -= self._values.pop(key).nbytes
+            if values.nbytes > self.max_bytes:
+                return
+            self._values[key] = values
+            self.num_bytes += values.nbytes
+
+            # Evict least recently used values
+            while self.num_bytes > self.max_bytes:
+                key, old_values = self._values.popitem(last=False)
+                self.num_bytes -= old_values.nbytes
+
+    def clear(self):
+        "Remove all values from cache"
+        with self._lock:
+            self._values.clear()
+            self.num_bytes = 0
+
+def _time_key(t):
+    "Return key for time t, insensitive to round-off in stored times"
+    return "%.12e" % t
+
+# Cache for primal and dual data (size set when series are created)
+_data_cache = DataCache(0)
+
+_primal_fields = ("u_F", "p_F", "U_S", "P_S", "U_M")
+
+# Lock for reading time series (from prefetching threads)
+_series_lock = threading.Lock()
+
+def clear_data_cache():
+    "Clear cached primal and dual data (call when mesh changes)"
+    _data_cache.clear()
+
+def create_prefetcher(times, series, parameters):
+    """Create prefetcher for primal data (None if prefetching is disabled).
+    Prefetching is only supported for the binary storage format since
+    DOLFIN time series may not be read while the solver is running."""
+    if parameters["prefetch_levels"] <= 0 or parameters["storage_cache_size"] <= 0:
+        return None
+    if not isinstance(series, BinaryTimeSeries):
+        info("Prefetching requires storage_format = binary, reading primal data on demand.")
+        return None
+    return PrimalDataPrefetcher(times, series, parameters["prefetch_levels"])
+
+class PrimalDataPrefetcher(object):
+    """Background reader for primal data. Given the order in which the
+    time levels will be read (forward for the error estimation and
+    backward for the dual solver), a pool of worker threads loads the
+    next num_levels time levels into the data cache while the caller is
+    busy assembling and solving, which hides the latency of reading
+    from disk. The workers only use numpy and file I/O, so the series
+    must be a BinaryTimeSeries."""
+
+    def __init__(self, times, series, num_levels, num_threads=2):
+        "Create prefetcher for given times (in traversal order)"
+        if not isinstance(series, BinaryTimeSeries):
+            error("Prefetching is only supported for binary time series.")
+        self.times = list(times)
+        self.series = series
+        self.num_levels = num_levels
+        self._positions = dict((_time_key(t), i) for (i, t) in enumerate(self.times))
+        self._loaded = {}
+        self._errors = {}
+        self._next = 0
+        self._queue = Queue.Queue()
+        self._threads = [threading.Thread(target=self._work) for i in range(num_threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def wait(self, t):
+        "Wait until data at time t has been loaded and schedule next levels"
+
+        # Just return if t is not part of the traversal
+        key = _time_key(t)
+        if not key in self._positions:
+            return
+
+        # Schedule loading of the next levels
+        last = min(self._positions[key] + self.num_levels + 1, len(self.times))
+        while self._next < last:
+            s = self.times[self._next]
+            self._loaded[_time_key(s)] = threading.Event()
+            self._queue.put(s)
+            self._next += 1
+
+        # Wait for data
+        self._loaded[key].wait()
+        if key in self._errors:
+            raise self._errors.pop(key)
+
+    def close(self):
+        "Stop worker threads"
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        "Load data for scheduled times until stopped"
+        while True:
+            t = self._queue.get()
+            if t is None:
+                break
+            try:
+                _prefetch_primal_values(t, self.series)
+            except Exception, e:
+                self._errors[_time_key(t)] = e
+            self._loaded[_time_key(t)].set()
+
+# Cache for submesh to global mesh dof mappings (one entry per mesh level)
+_globaldof_mappings = {}
+
 def get_globaldof_mappings(Omega,Omega_F,Omega_S, parameters):
-    """Get submesh to globalmesh mappings"""
+    """Get submesh to globalmesh mappings. The mappings are computed
+    once for each mesh and structure element degree and then cached
+    until clear_globaldof_mappings() is called."""
+
+    # Check if mappings have already been computed
+    key = (id(Omega), id(Omega_F), id(Omega_S), parameters["structure_element_degree"])
+    if key in _globaldof_mappings:
+        return _globaldof_mappings[key][1]
+
     # Get mappings from local meshes to global mesh
     v_F = Omega_F.data().mesh_function("parent_vertex_indices").array()
     v_S = Omega_S.data().mesh_function("parent_vertex_indices").array()
@@ -56,38 +346,43 @@ def get_globaldof_mappings(Omega,Omega_F,Omega_S, parameters):
     Ne = Omega.num_edges()
 
     # Compute mapping to global dofs
-    global_dofs_U_F = append(append(v_F, Nv + e_F), append((Nv + Ne) + v_F, (Nv + Ne + Nv) + e_F))
-    global_dofs_P_F = v_F
+    global_dofs_U_F = concatenate((v_F, Nv + e_F, (Nv + Ne) + v_F, (Nv + Ne + Nv) + e_F))
+    global_dofs_P_F = v_F.copy()
     if parameters["structure_element_degree"] == 1:
-        global_dofs_U_S = append(v_S, Nv + v_S)
+        global_dofs_U_S = concatenate((v_S, Nv + v_S))
         global_dofs_P_S = global_dofs_U_S
     else:
-        global_dofs_U_S = append(append(v_S, Nv + e_S), append((Nv + Ne) + v_S, (Nv + Ne + Nv) + e_S))
+        global_dofs_U_S = concatenate((v_S, Nv + e_S, (Nv + Ne) + v_S, (Nv + Ne + Nv) + e_S))
         global_dofs_P_S = global_dofs_U_S
-    global_dofs_U_M = append(v_F, Nv + v_F)
-    return (global_dofs_U_F, global_dofs_P_F,global_dofs_U_S,global_dofs_P_S,global_dofs_U_M)    
+    global_dofs_U_M = concatenate((v_F, Nv + v_F))
+    mappings = (global_dofs_U_F, global_dofs_P_F,global_dofs_U_S,global_dofs_P_S,global_dofs_U_M)
+
+    # Store mappings (keep meshes alive so that their ids are not reused)
+    _globaldof_mappings[key] = ((Omega, Omega_F, Omega_S), mappings)
+
+    return mappings
 
-def read_primal_data(U, t, Omega, Omega_F, Omega_S, series, parameters):
+def clear_globaldof_mappings():
+    "Clear cached submesh to global mesh mappings (call when mesh changes)"
+    _globaldof_mappings.clear()
+
+def read_primal_data(U, t, Omega, Omega_F, Omega_S, series, parameters,
+                     prefetcher=None):
     "Read primal variables at given time"
 
     info("Reading primal data at t = %g" % t)
 
+    # Wait for data to be read in the background
+    if prefetcher is not None:
+        prefetcher.wait(t)
+
     # Get primal variables
     U_F, P_F, U_S, P_S, U_M = U
 
-    # Create vectors for primal dof values on local meshes
-    local_vals_u_F = Vector()
-    local_vals_p_F = Vector()
-    local_vals_U_S = Vector()
-    local_vals_P_S = Vector()
-    local_vals_U_M = Vector()
-
     # Retrieve primal data
-    series[0].retrieve(local_vals_u_F, t)
-    series[1].retrieve(local_vals_p_F, t)
-    series[2].retrieve(local_vals_U_S, t)
-    series[3].retrieve(local_vals_P_S, t)
-    series[4].retrieve(local_vals_U_M, t)
+    (local_vals_u_F, local_vals_p_F, local_vals_U_S,
+     local_vals_P_S, local_vals_U_M) = _retrieve_primal_values(t, series)
+
     # Get mappings
     (global_dofs_U_F, global_dofs_P_F,global_dofs_U_S,global_dofs_P_S,global_dofs_U_M) = \
                       get_globaldof_mappings(Omega,Omega_F,Omega_S, parameters)
@@ -99,16 +394,72 @@ def read_primal_data(U, t, Omega, Omega_F, Omega_S, series, parameters):
     P_S.vector()[global_dofs_P_S] = local_vals_P_S
     U_M.vector()[global_dofs_U_M] = local_vals_U_M
 
+def _retrieve_primal_values(t, series):
+    "Retrieve primal dof values on local meshes (from cache if possible)"
+
+    # Check cache
+    values = [_data_cache.get(field, t) for field in _primal_fields]
+    if not None in values:
+        return values
+
+    # Read from file
+    with _series_lock:
+        if isinstance(series, BinaryTimeSeries):
+            values = series.retrieve(t)
+        else:
+            values = []
+            for i in range(5):
+                x = Vector()
+                series[i].retrieve(x, t)
+                values.append(x.array())
+
+    # Store in cache
+    for field, x in zip(_primal_fields, values):
+        _data_cache.put(field, t, x)
+
+    return values
+
+def _prefetch_primal_values(t, series):
+    "Load primal values into the cache without calling DOLFIN"
+    if not None in [_data_cache.get(field, t) for field in _primal_fields]:
+        return
+    with _series_lock:
+        values = series.retrieve_values(t)
+    if values is None:
+        raise RuntimeError("No data stored at t = %.16e in %s." % (t, series.filename))
+    for field, x in zip(_primal_fields, values):
+        _data_cache.put(field, t, x)
+
+def copy_primal_data(U, V):
+    "Copy primal variables V to U (used to reuse data between time steps)"
+    for (u, v) in zip(U, V):
+        u.assign(v)
+
 def read_dual_data(Z, t, series):
     "Read dual solution at given time"
     info("Reading dual data at t = %g" % t)
-    series.retrieve(Z.vector(), t, False)
+
+    # Check cache
+    values = _data_cache.get("Z", t)
+    if values is not None:
+        Z.vector()[:] = values
+        return
+
+    # Read from file
+    if isinstance(series, BinaryTimeSeries):
+        Z.vector()[:] = series.retrieve(t)[0]
+    else:
+        series.retrieve(Z.vector(), t, False)
+    _data_cache.put("Z", t, Z.vector().array())
 
 def read_timestep_range(T, series):
     "Read time step range"
 
     # Get nodal points for primal time series
-    t = series[0].vector_times()
+    if isinstance(series, BinaryTimeSeries):
+        t = series.vector_times()
+    else:
+        t = series[0].vector_times()
 
     # Check that time series is not empty and that it covers the interval
     if len(t) == 0:
@@ -120,10 +471,114 @@ def read_timestep_range(T, series):
 
     return t
 
-def write_primal_data(U, t, series):
-    "Write primal data at given time"
-    [series[i].store(U[i].vector(), t) for i in range(5)]
+def write_primal_data(U, t, series, writer=None):
+    """Write primal data at given time. For binary series, the values
+    are copied to arrays and written by the writer (if given)."""
+    values = [U[i].vector().array() for i in range(5)]
+    if isinstance(series, BinaryTimeSeries):
+        if writer is None:
+            series.store_values(values, t)
+        else:
+            writer.put(series.store_values, values, t)
+    else:
+        [series[i].store(U[i].vector(), t) for i in range(5)]
+    [_data_cache.put(_primal_fields[i], t, values[i]) for i in range(5)]
 
 def write_dual_data(Z, t, series):
     "Write dual solution at given time"
-    series.store(Z.vector(), t)
+    if isinstance(series, BinaryTimeSeries):
+        series.store([Z.vector()], t)
+    else:
+        series.store(Z.vector(), t)
+    _data_cache.put("Z", t, Z.vector().array())
+
+def append_to_file(filename, text, writer=None):
+    """Append text to file. With a writer, the file is written in the
+    background (plain file I/O, so safe to queue)."""
+    if writer is not None:
+        writer.put(append_to_file, filename, text)
+        return
+    f = open(filename, "a")
+    f.write(text)
+    f.close()
+
+def create_writer(parameters):
+    """Create writer for primal output. Writing in the background is
+    only supported for the binary storage format since DOLFIN files
+    may not be written while the solver is running."""
+    depth = parameters["write_queue_depth"]
+    if depth > 0 and not parameters["storage_format"] == "binary":
+        info("Background writing requires storage_format = binary, writing synchronously.")
+        depth = 0
+    return WriteBehindQueue(depth)
+
+class WriteBehindQueue(object):
+    """Writer for solution output. Write operations are handed to a
+    background thread through a queue of bounded depth so that the
+    solver may continue with the next time step while data is being
+    written. Operations are executed in the order they were added.
+    With a depth of 0, operations are executed immediately.
+
+    Operations must not call DOLFIN (only numpy and file I/O) and must
+    not depend on data that the solver modifies later."""
+
+    def __init__(self, depth):
+        "Create queue with given maximum number of pending operations"
+        self.depth = depth
+        self._error = None
+        self._thread = None
+        if depth > 0:
+            self._queue = Queue.Queue(maxsize=depth)
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def active(self):
+        "Return True if operations are executed in the background"
+        return self._thread is not None
+
+    def put(self, operation, *args):
+        "Add write operation (blocks if the queue is full)"
+        if not self.active():
+            operation(*args)
+            return
+        self._check()
+        self._queue.put((operation, args))
+
+    def flush(self):
+        "Wait until all pending operations have been executed"
+        if not self.active():
+            return
+        self._queue.join()
+        self._check()
+
+    def close(self, check=True):
+        "Execute pending operations and stop worker thread"
+        if not self.active():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if check:
+            self._check()
+
+    def _check(self):
+        "Raise error from worker thread (if any)"
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _work(self):
+        "Execute operations until stopped"
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            operation, args = item
+            try:
+                if self._error is None:
+                    operation(*args)
+            except Exception, e:
+                self._error = e
+            self._queue.task_done()
@@ -16,6 +16,7 @@ __all__ = ["FluidProblem", "StructureProblem", "MeshProblem",
            "extract_num_dofs"]
 
 from copy import copy
+import numpy
 
 from dolfin import *
 
@@ -177,25 +178,18 @@ class FluidProblem(NavierStokes):
         dim = self.omega_F1.geometry().dim()
         N = self.omega_F1.num_vertices()
 
-        # Update omega_F1
-        for i in range(N):
-            for j in range(dim):
-                x1[i][j] = X[i][j] + dofs[j*N + i]
+        # Update omega_F1 (dofs are ordered by component, then by vertex)
+        x1[:] = X + dofs[:dim*N].reshape((dim, N)).T
 
         # Smooth the mesh
         self.omega_F1.smooth(num_smoothings)
 
-        # Update mesh velocity
-        wx = self.w.vector().array()
-        for i in range(N):
-            for j in range(dim):
-                wx[j*N + i] =  (x1[i][j] - x0[i][j]) / dt
+        # Update mesh velocity (CG1, so values are set directly in the
+        # same layout without reading back the old values)
+        self.w.vector()[:] = ((x1 - x0) / dt).T.flatten()
 
-        # Update vector values (necessary since wx is a copy)
-        self.w.vector()[:] = wx
-
-        # Reassemble matrices
-        self.solver.reassemble()
+        # Mark matrices for full reassembly in the next step
+        self.solver.reassemble(lazy=True)
 
     def update_extra(self):
 
@@ -229,6 +223,15 @@ class StructureProblem(Hyperelasticity):
         self.N_S = FacetNormal(Omega_S)
         self.G_0 = problem.structure_boundary_traction_extra()
 
+        # Projection matrix, solver and vector for transfer of fluid stress
+        # (matrix only depends on the reference mesh so is assembled once)
+        self.A_F = None
+        self.B_F = None
+        self.projection_solver = None
+
+        # Buffers for checking convergence of FSI iteration
+        self._displacement_buffers = None
+
         # Calculate number of dofs
         self.num_dofs = 2 * self.V_S.dim()
 
@@ -290,19 +293,28 @@ class StructureProblem(Hyperelasticity):
         new = True
         if new:
             d_FSI = ds(2)
-            a_F = dot(self.test_F, self.trial_F)*d_FSI
+
+            # Assemble and factorize projection matrix (first time only)
+            if self.projection_solver is None:
+                a_F = dot(self.test_F, self.trial_F)*d_FSI
+                self.A_F = assemble(a_F,
+                                    exterior_facet_domains=self.problem.fsi_boundary_F)
+                self.A_F.ident_zeros()
+                self.projection_solver = LUSolver(self.A_F)
+                self.projection_solver.parameters["reuse_factorization"] = True
+
+            # Assemble traction (only facets on the FSI boundary contribute)
             L_F = - dot(self.test_F, dot(Sigma_F, self.N_F) + self.G_0)*d_FSI
-            A_F = assemble(a_F,
-                           exterior_facet_domains=self.problem.fsi_boundary_F)
-            B_F = assemble(L_F,
-                           exterior_facet_domains=self.problem.fsi_boundary_F)
+            self.B_F = assemble(L_F, tensor=self.B_F,
+                                exterior_facet_domains=self.problem.fsi_boundary_F)
+            self.projection_solver.solve(self.G_F.vector(), self.B_F)
         else:
             a_F = dot(self.test_F, self.trial_F)*ds
             L_F = - dot(self.test_F, dot(Sigma_F, self.N_F) + self.G_0)*ds
             A_F = assemble(a_F)
             B_F = assemble(L_F)
-        A_F.ident_zeros()
-        solve(A_F, self.G_F.vector(), B_F)
+            A_F.ident_zeros()
+            solve(A_F, self.G_F.vector(), B_F)
 
         # Add contribution from fluid vector to structure
         info("Transferring values to structure domain")
@@ -313,6 +325,17 @@ class StructureProblem(Hyperelasticity):
         # Uncomment to debug transfer of stress
         #self.debug_stress_transfer(Sigma_F)
 
+    def displacement_buffers(self, U_S, dofs=None):
+        """Return buffers for previous and current displacement at dofs
+        (all if None), initialized with U_S. The buffers are kept
+        between time steps."""
+        buffers = self._displacement_buffers
+        if buffers is None or buffers.dofs is not dofs:
+            buffers = DisplacementBuffers(dofs)
+            self._displacement_buffers = buffers
+        buffers.reset(U_S)
+        return buffers
+
     def time_stepping(self):
         return "CG1"
 
@@ -351,6 +374,49 @@ class StructureProblem(Hyperelasticity):
     def __str__(self):
         return "The structure problem (S)"
 
+class DisplacementBuffers:
+    """Pair of buffers holding the previous and current structure
+    displacement at a set of dofs (all if None), used for computing the
+    increment of the FSI iteration. The buffers are swapped by reference
+    and overwritten in place, so no vectors are allocated or copied
+    between iterations. The full displacement is stored as DOLFIN
+    vectors and a subset of dofs as numpy arrays."""
+
+    def __init__(self, dofs=None):
+        self.dofs = dofs
+        self.previous = None
+        self.current = None
+
+    def reset(self, U):
+        "Set current values to those of U"
+        if self.current is None:
+            if self.dofs is None:
+                self.current = U.vector().copy()
+            else:
+                self.current = U.vector()[self.dofs].array()
+            self.previous = self.current.copy()
+        else:
+            self._fill(self.current, U)
+
+    def update(self, U):
+        "Swap buffers, store values of U and return norm of increment"
+        self.previous, self.current = self.current, self.previous
+        self._fill(self.current, U)
+        if self.dofs is None:
+            # Previous values are overwritten by the next update
+            self.previous.axpy(-1.0, self.current)
+            return self.previous.norm("l2")
+        else:
+            return numpy.linalg.norm(self.current - self.previous)
+
+    def _fill(self, x, U):
+        "Copy values of U to x"
+        if self.dofs is None:
+            x.zero()
+            x.axpy(1.0, U.vector())
+        else:
+            x[:] = U.vector()[self.dofs].array()
+
 # Define mesh problem (time-dependent linear elasticity)
 class MeshProblem():
 
@@ -392,40 +458,84 @@ class MeshProblem():
         F_M = self.problem.mesh_right_hand_side()
         L += k*inner(v, F_M)*dx
 
+        # Split into mass and stiffness, a = m + 0.5*k*s and
+        # L = (m - 0.5*k*s)*u0 + k*f (matrices don't depend on k)
+        m = alpha*inner(v, u)*dx
+        s = inner(sym(grad(v)), _Sigma_M(u, mu, lmbda))*dx
+        f = inner(v, F_M)*dx
+
         # Store variables for time stepping
         self.u0 = u0
         self.u1 = u1
         self.a = a
         self.L = L
         self.k = k
+        self.f = f
+        self.M = assemble(m)
+        self.S = assemble(s)
         self.displacement = displacement
         self.bc = bc
 
+        # Factorized operators for recent time steps and right-hand
+        # side without boundary conditions for the current time step
+        self.solvers = {}
+        self.b0 = None
+        self.b0_dt = None
+
     def step(self, dt):
         "Compute solution for new time step"
 
         # Update time step
         self.k.assign(dt)
 
-        # Assemble linear system and apply boundary conditions
-        A = assemble(self.a)
-        b = assemble(self.L)
+        # Compute right-hand side (once per time step)
+        if self.b0 is None or not self.b0_dt == dt:
+            self.b0 = self.M*self.u0.vector()
+            self.b0.axpy(-0.5*dt, self.S*self.u0.vector())
+            self.b0.axpy(dt, assemble(self.f))
+            self.b0_dt = dt
 
-        self.bc.apply(A, b)
+        # Apply boundary conditions (displacement changes in each iteration)
+        b = self.b0.copy()
+        self.bc.apply(b)
 
         # Compute solution
-        solve(A, self.u1.vector(), b)
+        self._solver(dt).solve(self.u1.vector(), b)
 
         return self.u1
 
+    def _solver(self, dt):
+        "Return factorized operator for time step dt"
+        if not dt in self.solvers:
+
+            # Keep only a few time steps
+            if len(self.solvers) >= 4:
+                self.solvers.clear()
+
+            # Assemble (from mass and stiffness) and factorize
+            A = self.M.copy()
+            A.axpy(0.5*dt, self.S, True)
+            self.bc.apply(A)
+            solver = LUSolver(A)
+            solver.parameters["reuse_factorization"] = True
+            self.solvers[dt] = (A, solver)
+
+        return self.solvers[dt][1]
+
     def update(self, t):
         self.u0.assign(self.u1)
+        self.b0 = None
         return self.u1
 
     def update_structure_displacement(self, U_S):
         self.displacement.vector().zero()
         self.problem.add_s2f(self.displacement.vector(), U_S.vector())
 
+    def update_interface_displacement(self, values):
+        "Set boundary displacement from values at interface dofs"
+        self.displacement.vector().zero()
+        self.displacement.vector()[self.problem.fdofs] = values
+
     def solution(self):
         "Return current solution values"
         return self.u1
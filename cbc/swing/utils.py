@@ -15,8 +15,7 @@ def array_to_meshfunction(x, mesh):
     f = CellFunction("double", mesh)
     if not f.size() == x.size:
         raise RuntimeError, "Size of vector does not match number of cells."
-    for i in range(x.size):
-        f[i] = x[i]
+    f.array()[:] = x
     return f
 
 def date():
@@ -0,0 +1,18 @@
+"""Shared setup for the FSI Newton solver unit tests"""
+
+__author__ = "Gabriel Balaban"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from dolfin import Parameters
+from cbc.swing.parameters import fsinewton_params
+
+def newton_parameters(**values):
+    """Return a copy of the FSI Newton solver parameters without
+    Jacobian reuse and plotting, updated with values"""
+    params = Parameters(fsinewton_params)
+    params["optimization"]["reuse_jacobian"] = False
+    params["plot"] = False
+    for (key,value) in values.iteritems():
+        params[key] = value
+    return params
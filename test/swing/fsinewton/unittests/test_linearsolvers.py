@@ -0,0 +1,120 @@
+"""
+Tests for the linear solvers of the FSI Newton solver. The block
+preconditioner of the Newton-Krylov solver is checked on a synthetic
+saddle point system with the FSI block structure, a time step of
+FSIMini solved with GMRES is compared to the direct solve, and the
+reduced sparse solve is compared to a dense reference.
+"""
+
+__author__ = "Gabriel Balaban"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from dolfin import *
+import numpy as np
+import scipy.sparse as sps
+from scipy.sparse.linalg import gmres, spsolve
+from demo.swing.minimal.minimalproblem import FSIMini
+import cbc.swing.fsinewton.solver.solver_fsinewton as sfsi
+import cbc.swing.fsinewton.utils.misc_func as mf
+from cbc.swing.fsinewton.solver.mynewtonsolver import FSIBlockPreconditioner
+from fixtures import newton_parameters
+
+def laplacian(n):
+    return sps.diags([-np.ones(n - 1),2.5*np.ones(n),-np.ones(n - 1)],[-1,0,1])
+
+class TestBlockPreconditioner(object):
+    """Check GMRES with the block preconditioner on a synthetic system"""
+    def setup_class(self):
+        rng = np.random.RandomState(0)
+        sizes = [("U_F",40),("P_F",8),("L_U",4),("D_S",10),("U_S",10),("D_F",30),("L_D",5)]
+        dofs = {}
+        n = 0
+        for name,m in sizes:
+            dofs[name] = np.arange(n,n + m)
+            n += m
+        J = sps.lil_matrix((n,n))
+        block = lambda rows,cols: np.ix_(np.concatenate([dofs[f] for f in rows]),
+                                         np.concatenate([dofs[f] for f in cols]))
+
+        #Fluid and mesh blocks with zero diagonal constraint rows
+        J[block(["U_F"],["U_F"])] = (laplacian(40) + 0.3*sps.rand(40,40,0.05,random_state = rng)).toarray()
+        J[block(["D_S","U_S"],["D_S","U_S"])] = laplacian(20).toarray()
+        J[block(["D_F"],["D_F"])] = laplacian(30).toarray()
+        for u,c in [("U_F","P_F"),("U_F","L_U"),("D_F","L_D")]:
+            B = (sps.rand(len(dofs[c]),len(dofs[u]),0.3,random_state = rng) + \
+                 sps.eye(len(dofs[c]),len(dofs[u]))).toarray()
+            J[block([c],[u])] = B
+            J[block([u],[c])] = B.T
+
+        #Weak coupling between the blocks
+        self.J = (J.tocsr() + 0.05*sps.rand(n,n,0.01,random_state = rng)).tocsr()
+        self.b = rng.rand(n)
+        fields = lambda names: np.concatenate([dofs[f] for f in names] + [np.zeros(0,dtype = int)])
+        self.blockdofs = [(fields(["U_F"]),fields(["P_F","L_U"])),
+                          (fields(["D_S","U_S"]),fields([])),
+                          (fields(["D_F"]),fields(["L_D"]))]
+
+    def gmres_iterations(self,M = None):
+        residuals = []
+        x,flag = gmres(self.J,self.b,tol = 1.0e-10,restart = 200,maxiter = 1000,
+                       M = M,callback = residuals.append)
+        assert flag == 0, "GMRES did not converge"
+        assert np.allclose(x,spsolve(self.J.tocsc(),self.b),atol = 1.0e-8)
+        return len(residuals)
+
+    def test_preconditioners(self):
+        """The ILU and LU block preconditioners should cut the GMRES iterations"""
+        plain = self.gmres_iterations()
+        for method in ["ilu","lu"]:
+            precond = FSIBlockPreconditioner(self.J,self.blockdofs,method)
+            itr = self.gmres_iterations(precond.operator())
+            assert itr < plain/2
+
+class TestNewtonKrylov(object):
+    """Compare a Newton-Krylov time step with the direct solve"""
+    def time_step(self,linear_solver):
+        params = newton_parameters(linear_solver = linear_solver)
+        params["krylov"]["initial_forcing"] = 1.0e-8
+        params["krylov"]["maximum_forcing"] = 1.0e-8
+        fsisolver = sfsi.FSINewtonSolver(FSIMini(),params)
+        fsisolver.prepare_solve()
+        fsisolver.time_step()
+        return fsisolver.U1.vector().array()
+
+    def test_krylov(self):
+        """The Newton-Krylov step should converge to the direct solution"""
+        U_lu = self.time_step("lu")
+        U_krylov = self.time_step("krylov")
+        assert np.linalg.norm(U_krylov - U_lu) < 1.0e-6*max(1.0,np.linalg.norm(U_lu))
+
+class TestReducedSolve(object):
+    """Check the reduced Jacobian and solve against dense references"""
+    def test_submatrix(self):
+        """The CSR submatrix should match the dense submatrix"""
+        mesh = UnitSquare(4,4)
+        V = FunctionSpace(mesh,"CG",1)
+        u,v = TrialFunction(V),TestFunction(V)
+        A = assemble(inner(grad(u),grad(v))*dx + u*v*dx)
+        dofs = np.arange(0,V.dim(),3)
+        dense = A.array()[np.ix_(dofs,dofs)]
+        assert np.allclose(mf.dolfin_to_csr(A).toarray(),A.array())
+        assert np.allclose(mf.csr_submatrix(A,dofs).toarray(),dense)
+
+    def test_reduced_solve(self):
+        """The reduced increment should solve the dense reduced system"""
+        params = newton_parameters(linear_solver = "reduced",solve = False)
+        fsisolver = sfsi.FSINewtonSolver(FSIMini(),params)
+        fsisolver.prepare_solve()
+        newtonsolver = fsisolver.newtonsolver
+        newtonsolver.build_residual()
+        newtonsolver.build_jacobian()
+        newtonsolver.linear_solve()
+
+        dofs = np.array(fsisolver.spaces.usefuldofs,dtype = np.int64)
+        J = newtonsolver.J.array()[np.ix_(dofs,dofs)]
+        x = np.linalg.solve(J,-newtonsolver.F.array()[dofs])
+        inc = newtonsolver.inc.vector().array()
+        assert np.allclose(newtonsolver.J_sp.toarray(),J)
+        assert np.allclose(inc[dofs],x)
+        assert np.all(np.delete(inc,dofs) == 0.0)
@@ -0,0 +1,116 @@
+"""
+Tests for the Newton solver of the FSI Newton solver. The Jacobian
+refilled in place is compared to a newly assembled Jacobian, and the
+globalized Newton steps are checked on the scalar equation arctan(w) = 0.
+"""
+
+__author__ = "Gabriel Balaban"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from dolfin import *
+import numpy as np
+from demo.swing.minimal.minimalproblem import FSIMini
+import cbc.swing.fsinewton.solver.solver_fsinewton as sfsi
+from cbc.swing.fsinewton.solver.mynewtonsolver import MyNewtonSolver
+from fixtures import newton_parameters
+
+def create_newtonsolver(**values):
+    """Return the Newton solver of FSIMini, ready for assembly"""
+    fsisolver = sfsi.FSINewtonSolver(FSIMini(),newton_parameters(solve = False,**values))
+    fsisolver.prepare_solve()
+    return fsisolver.newtonsolver
+
+def perturb(w,seed):
+    """Add small random values to the function w"""
+    rng = np.random.RandomState(seed)
+    w.vector()[:] = w.vector().array() + 1.0e-2*rng.rand(w.vector().size())
+
+class ScalarProblem(object):
+    """Nonlinear problem with a single real unknown"""
+    def __init__(self,w0):
+        self.w = Function(FunctionSpace(UnitInterval(1),"R",0))
+        self.w.vector()[:] = w0
+        self.bc = None
+
+class ArctanNewtonSolver(MyNewtonSolver):
+    """Newton solver for arctan(w) = 0, where full Newton steps diverge
+    for |w| > 1.39"""
+    def build_residual(self):
+        self.F = Vector(1)
+        self.F[:] = np.arctan(self.problem.w.vector().array())
+
+    def build_jacobian(self):
+        w = self.problem.w.vector().array()
+        self.J = 1.0/(1.0 + w**2)
+
+    def linear_solve(self):
+        self.inc.vector()[:] = -self.F.array()/self.J
+
+class TestJacobianRefill(object):
+    """Compare the Jacobian refilled in place with a new Jacobian"""
+    def refill(self,jacobian):
+        newtonsolver = create_newtonsolver(jacobian = jacobian)
+        newtonsolver.build_residual()
+        newtonsolver.build_jacobian()
+        newtonsolver.linear_solve()
+        J = newtonsolver.J
+
+        #Rebuild at a new state and solve with the numeric refactorization
+        perturb(newtonsolver.problem.w,0)
+        newtonsolver.build_residual()
+        newtonsolver.build_jacobian()
+        newtonsolver.linear_solve()
+        refilled = newtonsolver.J.array()
+        inc = np.linalg.solve(refilled,-newtonsolver.F.array())
+        assert newtonsolver.J is J
+        assert np.allclose(newtonsolver.inc.vector().array(),inc)
+
+        #Assemble a new Jacobian at the same state
+        newtonsolver.J = None
+        newtonsolver.build_jacobian()
+        assert np.allclose(refilled,newtonsolver.J.array())
+
+    def test_buffered(self):
+        """The buffered Jacobian should be refilled correctly"""
+        self.refill("buff")
+
+    def test_manual(self):
+        """The unbuffered Jacobian should be refilled correctly"""
+        self.refill("manual")
+
+class TestGlobalization(object):
+    """Check the globalized Newton steps against full Newton steps"""
+    def iterate(self,globalization,n):
+        newtonsolver = ArctanNewtonSolver(ScalarProblem(2.0),tol = 1.0e-12,
+                                          globalization = globalization)
+        for i in range(n):
+            newtonsolver.step(newtonsolver.tol)
+            if newtonsolver.E < newtonsolver.tol:
+                break
+        return newtonsolver
+
+    def test_none(self):
+        """Full Newton steps should diverge from w = 2"""
+        newtonsolver = self.iterate("none",3)
+        assert abs(newtonsolver.problem.w.vector().array()[0]) > 100.0
+
+    def test_armijo(self):
+        """The line search should converge with decreasing residuals"""
+        newtonsolver = self.iterate("armijo",20)
+        residuals = [E for (itr,E) in newtonsolver.res]
+        assert newtonsolver.E < newtonsolver.tol
+        assert np.all(np.diff(residuals) < 0.0)
+
+    def test_damped(self):
+        """The damping should follow the ratio of the residual norms"""
+        newtonsolver = ArctanNewtonSolver(ScalarProblem(0.0),globalization = "damped")
+        newtonsolver.inc.vector()[:] = 1.0
+        w = newtonsolver.problem.w.vector()
+        steps = [(1.0,1.0,1.0),(1.0,2.0,0.5),(2.0,1.0,1.0),(1.0,100.0,0.1)]
+        for (itr,(lastresidual,E,damping)) in enumerate(steps):
+            (newtonsolver.itr,newtonsolver.lastresidual,newtonsolver.E) = (itr,lastresidual,E)
+            w0 = w.array()[0]
+            newtonsolver.damped_update()
+            assert np.allclose(newtonsolver.damping,damping)
+            assert np.allclose(w.array()[0] - w0,damping)
@@ -0,0 +1,67 @@
+"""
+Tests for the extrapolated initial guess of the FSI Newton solver.
+The Lagrange extrapolation is compared to closed form weights and
+should be exact for polynomial data of its order.
+"""
+
+__author__ = "Gabriel Balaban"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from collections import deque
+from dolfin import Vector
+import numpy as np
+from cbc.swing.fsinewton.solver.solver_fsinewton import FSINewtonSolver
+
+class VectorFunction(object):
+    """Function-like wrapper of a vector"""
+    def __init__(self,n):
+        self.x = Vector(n)
+    def vector(self):
+        return self.x
+
+class Predictor(FSINewtonSolver):
+    """FSI Newton solver with only the data needed for the predictor"""
+    def __init__(self,order,n):
+        self.history = deque(maxlen = order + 1)
+        self.U1 = VectorFunction(n)
+        self.t = 0.0
+
+    def store(self,t,values):
+        U = Vector(len(values))
+        U[:] = values
+        self.history.append((t,U))
+
+class TestPredictor(object):
+    """Compare the extrapolated initial guess with closed form results"""
+    def setup_class(self):
+        np.random.seed(0)
+        self.coefficients = np.random.rand(3,10)
+
+    def polynomial(self,t,order):
+        return sum(self.coefficients[i]*t**i for i in range(order + 1))
+
+    def predict(self,order,times,data):
+        """Extrapolate data at the previous times to the last time"""
+        predictor = Predictor(order,len(data[0]))
+        for (t,values) in zip(times[:-1],data):
+            predictor.store(t,values)
+        predictor.t = times[-1]
+        predictor.predict()
+        return predictor.U1.vector().array()
+
+    def test_exact(self):
+        """Extrapolation should be exact for polynomials of its order"""
+        times = [0.0,0.1,0.3,0.4]
+        for order in range(3):
+            data = [self.polynomial(t,order) for t in times[:-1]]
+            U1 = self.predict(order,times,data)
+            assert np.allclose(U1,self.polynomial(times[-1],order))
+
+    def test_weights(self):
+        """Uniform time steps should give the finite difference weights"""
+        times = [0.0,0.1,0.2,0.3]
+        weights = {0:[0,0,1],1:[0,-1,2],2:[1,-3,3]}
+        for order in range(3):
+            U1 = self.predict(order,times,list(self.coefficients))
+            assert np.allclose(U1,np.dot(weights[order],self.coefficients))
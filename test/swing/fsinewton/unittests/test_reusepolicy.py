@@ -0,0 +1,50 @@
+"""
+Tests for the adaptive Jacobian reuse policy of the Newton solver
+"""
+
+__author__ = "Gabriel Balaban"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from cbc.swing.fsinewton.solver.mynewtonsolver import JacobianReusePolicy
+
+class TestJacobianReusePolicy(object):
+    """Check the rebuild decision for given measurements"""
+    def setup_class(self):
+        self.tol = 1.0e-10
+        self.E = 1.0e-2
+
+    def policy(self,cost_step,cost_rebuild_step,rate_fresh,rate):
+        policy = JacobianReusePolicy(max_reuse = 30)
+        policy.record_step(cost_rebuild_step,True)
+        policy.record_rate(rate_fresh,1.0)
+        policy.record_step(cost_step,False)
+        policy.record_rate(rate,1.0)
+        return policy
+
+    def test_max_reuse(self):
+        """The Jacobian should be rebuilt after max_reuse steps"""
+        policy = JacobianReusePolicy(max_reuse = 5)
+        assert policy.rebuild(self.E,self.tol,5)
+
+    def test_no_measurements(self):
+        """Without measurements the Jacobian should be reused"""
+        policy = JacobianReusePolicy(max_reuse = 30)
+        assert not policy.rebuild(self.E,self.tol,1)
+        policy.record_rate(0.5,1.0)
+        assert not policy.rebuild(self.E,self.tol,1)
+
+    def test_divergence(self):
+        """A growing residual should trigger a rebuild"""
+        policy = self.policy(1.0,1.0,0.1,1.5)
+        assert policy.rebuild(self.E,self.tol,1)
+
+    def test_fresh_not_faster(self):
+        """No rebuild if a fresh Jacobian does not contract faster"""
+        policy = self.policy(1.0,1.0,0.5,0.4)
+        assert not policy.rebuild(self.E,self.tol,1)
+
+    def test_cost(self):
+        """Rebuild only if the saved steps outweigh the rebuild cost"""
+        assert self.policy(1.0,2.0,0.01,0.5).rebuild(self.E,self.tol,1)
+        assert not self.policy(1.0,100.0,0.01,0.5).rebuild(self.E,self.tol,1)
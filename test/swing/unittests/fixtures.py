@@ -0,0 +1,24 @@
+"""Shared setup for the cbc.swing unit tests"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import shutil
+import tempfile
+from cbc.swing.parameters import default_parameters
+
+def binary_storage_parameters(**values):
+    """Return default parameters with binary storage, a small data
+    cache and a new temporary output directory, updated with values"""
+    parameters = default_parameters()
+    parameters["storage_format"] = "binary"
+    parameters["storage_cache_size"] = 1
+    parameters["output_directory"] = tempfile.mkdtemp()
+    for (key, value) in values.iteritems():
+        parameters[key] = value
+    return parameters
+
+def remove_output_directory(parameters):
+    "Remove the temporary output directory"
+    shutil.rmtree(parameters["output_directory"])
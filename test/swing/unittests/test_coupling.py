@@ -0,0 +1,81 @@
+"""Tests for the coupling accelerators in cbc.swing.coupling"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import numpy as np
+from dolfin import Vector
+from cbc.swing.coupling import create_coupling_accelerator
+
+def create_accelerator(method, reuse=0):
+    "Create accelerator with relaxation factor 0.5"
+    parameters = {"coupling_acceleration": method,
+                  "coupling_relaxation": 0.5,
+                  "coupling_reuse": reuse}
+    return create_coupling_accelerator(parameters)
+
+class TestCouplingAccelerator(object):
+    """Compare accelerated and plain iteration on a linear fixed point map"""
+    def setup_class(self):
+        np.random.seed(0)
+        n = 20
+        Q = np.linalg.qr(np.random.rand(n, n))[0]
+        self.A = np.dot(Q, np.dot(np.diag(np.linspace(-1.5, 0.5, n)), Q.T))
+        self.b = np.random.rand(n)
+        self.x = np.linalg.solve(np.eye(n) - self.A, self.b)
+
+    def iterate(self, method, reuse=0, x0=None, maxiter=200):
+        "Return number of iterations needed to converge"
+        accelerator = create_accelerator(method, reuse)
+        if accelerator is not None:
+            accelerator.new_time_step()
+        x = np.zeros(len(self.b)) if x0 is None else x0
+        for i in range(maxiter):
+            x_tilde = np.dot(self.A, x) + self.b
+            if np.linalg.norm(x_tilde - x) < 1e-10:
+                return i, accelerator
+            x = x_tilde if accelerator is None else accelerator.update(x_tilde)
+        return maxiter, accelerator
+
+    def test_plain_diverges(self):
+        """Plain iteration should not converge (spectral radius > 1)"""
+        assert self.iterate("none")[0] == 200
+
+    def test_aitken(self):
+        """Aitken relaxation should converge to the fixed point"""
+        assert self.iterate("aitken")[0] < 200
+
+    def test_iqnils(self):
+        """IQN-ILS should converge within a few more iterations than unknowns"""
+        assert self.iterate("iqn-ils")[0] <= len(self.b) + 3
+
+    def test_iqnils_reuse(self):
+        """Reusing secant data should speed up the next time step"""
+        num_iter, accelerator = self.iterate("iqn-ils", reuse=1)
+        accelerator.new_time_step()
+        x = np.zeros(len(self.b))
+        for i in range(num_iter):
+            x_tilde = np.dot(self.A, x) + self.b
+            if np.linalg.norm(x_tilde - x) < 1e-10:
+                break
+            x = accelerator.update(x_tilde)
+        assert i < num_iter - 1
+
+    def test_dolfin_vectors(self):
+        """Accelerators should work on values extracted from and written
+        back to DOLFIN vectors at interface dofs, as in fixpoint_solve"""
+        n = len(self.b)
+        sdofs = np.arange(3, 3 + 2*n, 2, dtype="I")
+        fdofs = np.arange(n, dtype="I")[::-1].copy()
+        for method in ["aitken", "iqn-ils"]:
+            accelerator = create_accelerator(method)
+            accelerator.new_time_step()
+            U_S = Vector(3 + 2*n)
+            U_M = Vector(n + 5)
+            for i in range(100):
+                U_S[sdofs] = np.dot(self.A, U_M[fdofs].array()) + self.b
+                x = accelerator.update(U_S[sdofs].array())
+                U_M.zero()
+                U_M[fdofs] = x
+            assert np.allclose(U_M[fdofs].array(), self.x)
@@ -0,0 +1,54 @@
+"""Tests for the reuse of the dual factorization in cbc.swing.dualsolver"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+from dolfin import *
+from cbc.swing.dualsolver import DualLinearSolver
+
+class TestDualLinearSolver(object):
+    """Compare solves with a reused factorization with direct solves"""
+    def setup_class(self):
+        mesh = UnitSquare(8, 8)
+        V = FunctionSpace(mesh, "CG", 1)
+        u, v = TrialFunction(V), TestFunction(V)
+        self.a = lambda c: inner(grad(u), grad(v))*dx + Constant(c)*u*v*dx
+        self.b = assemble(v*dx)
+        self.parameters = {"reuse_factorization": True,
+                           "reuse_tolerance": 1e-10,
+                           "reuse_iterations": 10}
+
+    def direct(self, A):
+        x = Vector(self.b.size())
+        solve(A, x, self.b)
+        return x
+
+    def error(self, A, x):
+        e = x.copy()
+        e -= self.direct(A)
+        return e.norm("l2") / x.norm("l2")
+
+    def test_reuse(self):
+        """A slightly changed matrix should be solved with the old factors"""
+        solver = DualLinearSolver(self.parameters)
+        x = Vector(self.b.size())
+        solver.solve(assemble(self.a(1.0)), x, self.b)
+        lusolver = solver.lusolver
+        A = assemble(self.a(1.01))
+        solver.solve(A, x, self.b)
+        assert solver.lusolver is lusolver
+        assert self.error(A, x) < 1e-8
+
+    def test_refactorize(self):
+        """A large change should hit the iteration limit and refactorize"""
+        parameters = dict(self.parameters)
+        parameters["reuse_iterations"] = 1
+        solver = DualLinearSolver(parameters)
+        x = Vector(self.b.size())
+        solver.solve(assemble(self.a(1.0)), x, self.b)
+        lusolver = solver.lusolver
+        A = assemble(self.a(100.0))
+        solver.solve(A, x, self.b)
+        assert solver.lusolver is not lusolver
+        assert self.error(A, x) < 1e-8
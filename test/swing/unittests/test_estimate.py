@@ -0,0 +1,57 @@
+"""Tests for the parallel evaluation of the error estimate over time
+intervals in cbc.swing.adaptivity"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import os
+import numpy as np
+from cbc.swing.adaptivity import _estimate_in_parallel, _add_partial_sums, \
+     _time_intervals
+
+class TestParallelEstimate(object):
+    """Compare estimates summed on slices in worker processes with the
+    serial sum"""
+    def setup_class(self):
+        np.random.seed(0)
+        self.num_cells = 50
+        self.residuals = np.random.rand(21, self.num_cells)
+        self.intervals = range(1, len(self.residuals))
+
+    def estimate_intervals(self, intervals):
+        "Sum fake residuals over intervals in the same layout as estimate_error"
+        errors = [0.0]*7
+        eta = [[np.zeros(self.num_cells) for k in range(n)] for n in (2, 1, 1)]
+        for i in intervals:
+            r = self.residuals[i] - self.residuals[i - 1]
+            for j in range(7):
+                errors[j] += (j + 1)*r[j]
+            for etas in eta:
+                for k in range(len(etas)):
+                    etas[k] += (k + 1)*abs(r)
+        return tuple(errors + eta + [os.getpid()])
+
+    def test_parallel(self):
+        """Parallel and serial estimates should agree"""
+        serial = _add_partial_sums([self.estimate_intervals(self.intervals)])
+        partial_sums = _estimate_in_parallel(self.estimate_intervals,
+                                             self.intervals, 3)
+        parallel = _add_partial_sums(partial_sums)
+        assert len(partial_sums) == 3
+        assert os.getpid() not in [p[-1] for p in partial_sums]
+        assert np.allclose(parallel[:7], serial[:7])
+        for j in range(7, 10):
+            assert len(parallel[j]) == len(serial[j])
+            for a, b in zip(parallel[j], serial[j]):
+                assert np.allclose(a, b)
+
+    def test_time_intervals(self):
+        """Estimating with fewer than two time levels should fail clearly"""
+        assert _time_intervals([0.0, 0.1, 0.2]) == [1, 2]
+        for timestep_range in [[], [0.0]]:
+            try:
+                _time_intervals(timestep_range)
+                assert False
+            except RuntimeError:
+                pass
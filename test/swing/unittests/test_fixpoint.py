@@ -0,0 +1,113 @@
+"""Tests for the convergence check of the fixed point FSI iteration"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import numpy as np
+from dolfin import Vector
+from cbc.swing.primalsolver import fixpoint_solve
+from cbc.swing.subproblems import StructureProblem, DisplacementBuffers
+
+class VectorFunction(object):
+    "Function-like wrapper of a vector"
+    def __init__(self, n):
+        self.x = Vector(n)
+    def vector(self):
+        return self.x
+
+class FluidStub(object):
+    "Fluid problem doing nothing"
+    def solution_values(self):
+        return None, None, None, None
+    def step(self, dt):
+        pass
+    def compute_fluid_stress(self, *args):
+        return None
+    def update_mesh_displacement(self, U_M, dt, num_smoothings):
+        pass
+
+class StructureStub(object):
+    """Structure problem where the interface displacement converges and
+    the interior displacement oscillates"""
+    displacement_buffers = StructureProblem.__dict__["displacement_buffers"]
+    def __init__(self, n, sdofs):
+        self._displacement_buffers = None
+        self.sdofs = sdofs
+        self.U = VectorFunction(n)
+        self.sign = 1.0
+    def update_fluid_stress(self, Sigma_F):
+        pass
+    def step(self, dt):
+        values = self.U.vector().array()
+        interface = values[self.sdofs]
+        self.sign = -self.sign
+        values[:] = self.sign
+        values[self.sdofs] = 0.5*interface + 1.0
+        self.U.vector()[:] = values
+        return self.U, None
+
+class MeshStub(object):
+    "Mesh problem doing nothing"
+    def solution_values(self):
+        return None, None
+    def update_structure_displacement(self, U_S):
+        pass
+    def update_interface_displacement(self, values):
+        pass
+    def step(self, dt):
+        pass
+
+class ProblemStub(object):
+    def __init__(self, sdofs):
+        self.sdofs = sdofs
+
+class TestFixpointConvergence(object):
+    """Check the interface and full convergence norms"""
+    def setup_class(self):
+        self.n = 10
+        self.sdofs = np.array([2, 5, 7], dtype="I")
+
+    def solve(self, norm):
+        parameters = {"maximum_iterations": 100,
+                      "num_smoothings": 0,
+                      "fsi_convergence_norm": norm}
+        S = StructureStub(self.n, self.sdofs)
+        U_S0 = VectorFunction(self.n)
+        history = []
+        result = fixpoint_solve(FluidStub(), S, U_S0, MeshStub(), 0.1, 0.1,
+                                parameters, 1.0e-8, ProblemStub(self.sdofs),
+                                None, history)
+        return result, history
+
+    def test_interface(self):
+        """Interface norm should converge although interior dofs do not"""
+        (U_S0, U_S1, P_S1, increment, numiter), history = self.solve("interface")
+        assert increment < 1.0e-8
+        assert len(history) == numiter + 1
+        assert np.allclose(U_S0.vector().array()[self.sdofs], 2.0)
+        assert np.allclose(history[1:], 0.5*np.array(history[:-1]))
+
+    def test_full(self):
+        """Full norm should not converge since interior dofs oscillate"""
+        try:
+            self.solve("full")
+            assert False
+        except RuntimeError:
+            pass
+
+    def test_buffers(self):
+        """Buffers should be swapped, not copied, and return increments"""
+        for dofs in [None, self.sdofs]:
+            U = VectorFunction(self.n)
+            buffers = DisplacementBuffers(dofs)
+            buffers.reset(U)
+            first, second = buffers.current, buffers.previous
+            U.vector()[:] = np.ones(self.n)
+            increment = buffers.update(U)
+            assert buffers.current is second and buffers.previous is first
+            num_dofs = self.n if dofs is None else len(dofs)
+            assert abs(increment - np.sqrt(num_dofs)) < 1.0e-12
+            U.vector()[:] = 3.0*np.ones(self.n)
+            assert abs(buffers.update(U) - 2.0*np.sqrt(num_dofs)) < 1.0e-12
+            assert buffers.current is first
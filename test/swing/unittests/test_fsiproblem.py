@@ -0,0 +1,45 @@
+"""Tests for the transfer of values between the fluid and structure
+dofs in cbc.swing.fsiproblem"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import numpy as np
+from dolfin import Vector
+from cbc.swing.fsiproblem import FixedPointFSI
+
+class InterfaceDofs(FixedPointFSI):
+    "FSI problem with only the interface dofs"
+    def __init__(self, fdofs, sdofs):
+        self.fdofs = fdofs.astype("uint32")
+        self.sdofs = sdofs.astype("uint32")
+
+class TestInterfaceTransfer(object):
+    """Compare the transfer of interface values with adding the full
+    arrays"""
+    def setup_class(self):
+        np.random.seed(0)
+        self.problem = InterfaceDofs(np.random.permutation(40)[:10],
+                                     np.random.permutation(30)[:10])
+
+    def vector(self, n):
+        x = Vector(n)
+        x[:] = np.random.rand(n)
+        return x
+
+    def test_add_f2s(self):
+        """Only the structure values at the interface should change"""
+        xs, xf = self.vector(30), self.vector(40)
+        xs_array = xs.array()
+        xs_array[self.problem.sdofs] += xf.array()[self.problem.fdofs]
+        self.problem.add_f2s(xs, xf)
+        assert np.allclose(xs.array(), xs_array)
+
+    def test_add_s2f(self):
+        """Only the fluid values at the interface should change"""
+        xs, xf = self.vector(30), self.vector(40)
+        xf_array = xf.array()
+        xf_array[self.problem.fdofs] += xs.array()[self.problem.sdofs]
+        self.problem.add_s2f(xf, xs)
+        assert np.allclose(xf.array(), xf_array)
@@ -0,0 +1,56 @@
+"""Tests for the marking strategies in cbc.swing.adaptivity"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import numpy as np
+import cbc.swing.adaptivity as adaptivity
+from cbc.swing.adaptivity import mark_cells
+
+class TestMarkCells(object):
+    """Compare marking strategies against a simple reference"""
+    def setup_class(self):
+        np.random.seed(0)
+        self.indicators = np.random.rand(1000)**4
+
+    def dorfler_reference(self, fraction):
+        """Cell by cell Dorfler marking (the original implementation)"""
+        marked = np.zeros(len(self.indicators), dtype=bool)
+        total_sum = np.sum(self.indicators)
+        sub_sum = 0.0
+        for i in reversed(np.argsort(self.indicators)):
+            sub_sum += self.indicators[i]
+            marked[i] = True
+            if sub_sum >= fraction * total_sum:
+                break
+        return marked
+
+    def test_dorfler(self):
+        """Dorfler marking should mark the same cells as the reference"""
+        for fraction in [0.1, 0.5, 0.9, 1.0]:
+            marked = mark_cells(self.indicators, fraction, "dorfler")
+            assert np.all(marked == self.dorfler_reference(fraction))
+
+    def test_fixed_fraction(self):
+        """Fixed fraction marking should mark the largest indicators"""
+        marked = mark_cells(self.indicators, 0.25, "fixed_fraction")
+        assert np.sum(marked) == 250
+        assert np.min(self.indicators[marked]) >= np.max(self.indicators[~marked])
+
+    def test_equidistribution(self):
+        """Equidistribution marking should mark indicators above the mean"""
+        marked = mark_cells(self.indicators, 0.5, "equidistribution")
+        assert np.all(marked == (self.indicators > np.mean(self.indicators)))
+
+    def test_sort_fallback(self):
+        """Marking should not change when numpy lacks argpartition"""
+        strategies = [("dorfler", 0.5), ("fixed_fraction", 0.25)]
+        marked = [mark_cells(self.indicators, f, s) for (s, f) in strategies]
+        has_argpartition = adaptivity._has_argpartition
+        adaptivity._has_argpartition = False
+        try:
+            for (s, f), m in zip(strategies, marked):
+                assert np.all(mark_cells(self.indicators, f, s) == m)
+        finally:
+            adaptivity._has_argpartition = has_argpartition
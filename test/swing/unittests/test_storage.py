@@ -0,0 +1,226 @@
+"""Tests for the binary time series and data cache in cbc.swing.storage"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import threading
+import numpy as np
+from dolfin import *
+from cbc.swing import storage
+from cbc.swing.parameters import default_parameters
+from fixtures import binary_storage_parameters, remove_output_directory
+from cbc.swing.storage import BinaryTimeSeries, DataCache, PrimalDataPrefetcher, \
+     create_primal_series, create_prefetcher, clear_data_cache, \
+     WriteBehindQueue, create_writer, append_to_file
+
+class TestBinaryTimeSeries(object):
+    """Store a few time levels and read them back"""
+    def setup_class(self):
+        self.sizes = [7, 3, 5]
+        self.times = [0.0, 0.1, 0.25, 0.3]
+        self.parameters = binary_storage_parameters()
+        self.directory = self.parameters["output_directory"]
+
+    def teardown_class(self):
+        remove_output_directory(self.parameters)
+
+    def create_vectors(self, t):
+        vectors = []
+        for n in self.sizes:
+            v = Vector(n)
+            v[:] = np.arange(n) + t
+            vectors.append(v)
+        return vectors
+
+    def test_store_retrieve(self):
+        """Values read by a new series should match the stored values"""
+        writer = BinaryTimeSeries("%s/primal_0" % self.directory, len(self.sizes))
+        for t in self.times:
+            writer.store(self.create_vectors(t), t)
+
+        reader = BinaryTimeSeries("%s/primal_0" % self.directory, len(self.sizes))
+        assert np.allclose(reader.vector_times(), self.times)
+        for t in reversed(self.times):
+            values = reader.retrieve(t)
+            assert [len(x) for x in values] == self.sizes
+            for x, v in zip(values, self.create_vectors(t)):
+                assert np.all(x == v.array())
+
+    def test_new_level_truncates(self):
+        """The first store on a new series should start a new file"""
+        writer = BinaryTimeSeries("%s/primal_1" % self.directory, len(self.sizes))
+        writer.store(self.create_vectors(0.0), 0.0)
+        writer = BinaryTimeSeries("%s/primal_1" % self.directory, len(self.sizes))
+        writer.store(self.create_vectors(0.0), 0.0)
+        reader = BinaryTimeSeries("%s/primal_1" % self.directory, len(self.sizes))
+        assert len(reader.vector_times()) == 1
+
+    def test_prefetch_backward(self):
+        """Prefetched levels should be found in the data cache"""
+        sizes = [4, 2, 3, 1, 4]
+        writer = create_primal_series(self.parameters, 2)
+        for t in self.times:
+            writer.store([Vector(n) for n in sizes], t)
+
+        clear_data_cache()
+        prefetcher = PrimalDataPrefetcher(reversed(self.times), writer, 2)
+        prefetcher.wait(self.times[-1])
+        prefetcher.close()
+        for t in self.times[1:]:
+            assert storage._data_cache.get("U_M", t) is not None
+        assert storage._data_cache.get("U_M", self.times[0]) is None
+
+class TestPrimalDataPrefetcher(object):
+    """Check order of prefetching, errors and shutdown"""
+    def setup_class(self):
+        self.times = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5]
+        self.parameters = binary_storage_parameters(prefetch_levels=1)
+        self.directory = self.parameters["output_directory"]
+        self.series = create_primal_series(self.parameters, 0)
+        for t in self.times:
+            self.series.store([Vector(3) for i in range(5)], t)
+
+    def teardown_class(self):
+        remove_output_directory(self.parameters)
+
+    def test_order(self):
+        """Only the next prefetch_levels levels should be read ahead"""
+        clear_data_cache()
+        times = list(reversed(self.times))
+        prefetcher = create_prefetcher(times, self.series, self.parameters)
+        for (i, t) in enumerate(times):
+            prefetcher.wait(t)
+            assert storage._data_cache.get("U_M", t) is not None
+            for s in times[i + 2:]:
+                assert storage._data_cache.get("U_M", s) is None
+        prefetcher.close()
+
+    def test_missing(self):
+        """Errors in worker threads should be raised by wait()"""
+        clear_data_cache()
+        prefetcher = PrimalDataPrefetcher([0.0, 0.05], self.series, 1)
+        prefetcher.wait(0.0)
+        try:
+            prefetcher.wait(0.05)
+            assert False
+        except RuntimeError:
+            pass
+        prefetcher.close()
+
+    def test_close(self):
+        """All worker threads should be stopped by close()"""
+        num_threads = threading.active_count()
+        prefetcher = PrimalDataPrefetcher(self.times, self.series, 2, num_threads=3)
+        assert threading.active_count() == num_threads + 3
+        prefetcher.wait(self.times[0])
+        prefetcher.close()
+        assert threading.active_count() == num_threads
+
+    def test_timeseries_backend(self):
+        """Prefetching should be disabled for DOLFIN time series"""
+        series = tuple(TimeSeries("%s/bin/%s" % (self.directory, name))
+                       for name in ("u_F", "p_F", "U_S", "P_S", "U_M"))
+        assert create_prefetcher(self.times, series, self.parameters) is None
+
+class TestDataCache(object):
+    """Check the least recently used policy of the data cache"""
+    def test_eviction(self):
+        """The least recently used values should be evicted first"""
+        x = np.zeros(10)
+        cache = DataCache(3*x.nbytes)
+        for t in [0.0, 0.1, 0.2]:
+            cache.put("u_F", t, x + t)
+        cache.get("u_F", 0.0)
+        cache.put("u_F", 0.3, x)
+        assert cache.get("u_F", 0.1) is None
+        assert cache.get("u_F", 0.0) is not None
+        assert cache.get("u_F", 0.2 + 1.0e-16) is not None
+        assert cache.num_bytes == 3*x.nbytes
+
+class TestWriteBehindQueue(object):
+    """Check order, flushing, shutdown and errors of the write queue"""
+    def fail(self):
+        raise ValueError("write failed")
+
+    def test_order(self):
+        """Operations should be executed in order before flush() returns"""
+        written = []
+        writer = WriteBehindQueue(2)
+        assert writer.active()
+        for i in range(10):
+            writer.put(written.append, i)
+        writer.flush()
+        assert written == range(10)
+        writer.close()
+        assert not writer.active()
+
+    def test_append(self):
+        """Queued appends should write the file in order"""
+        parameters = binary_storage_parameters()
+        filename = "%s/output.txt" % parameters["output_directory"]
+        writer = WriteBehindQueue(2)
+        for i in range(5):
+            append_to_file(filename, "%d\n" % i, writer)
+        writer.close()
+        lines = open(filename).read().split()
+        remove_output_directory(parameters)
+        assert lines == [str(i) for i in range(5)]
+
+    def test_synchronous(self):
+        """With depth 0, operations should be executed immediately"""
+        written = []
+        writer = WriteBehindQueue(0)
+        assert not writer.active()
+        writer.put(written.append, 1)
+        assert written == [1]
+
+    def test_close(self):
+        """Pending operations should be executed by close()"""
+        written = []
+        num_threads = threading.active_count()
+        writer = WriteBehindQueue(3)
+        for i in range(3):
+            writer.put(written.append, i)
+        writer.close()
+        assert written == range(3)
+        assert threading.active_count() == num_threads
+
+    def test_error(self):
+        """Errors should be raised by flush() and skip later operations"""
+        written = []
+        writer = WriteBehindQueue(2)
+        writer.put(self.fail)
+        writer.put(written.append, 1)
+        try:
+            writer.flush()
+            assert False
+        except ValueError:
+            pass
+        assert written == []
+        writer.put(written.append, 2)
+        writer.close()
+        assert written == [2]
+
+    def test_close_error(self):
+        """Errors should be raised by close() unless check is False"""
+        writer = WriteBehindQueue(1)
+        writer.put(self.fail)
+        try:
+            writer.close()
+            assert False
+        except ValueError:
+            pass
+        writer = WriteBehindQueue(1)
+        writer.put(self.fail)
+        writer.close(check=False)
+
+    def test_timeseries_backend(self):
+        """Writing should be synchronous for DOLFIN time series"""
+        parameters = default_parameters()
+        parameters["write_queue_depth"] = 4
+        assert not create_writer(parameters).active()
+        parameters["storage_format"] = "binary"
+        writer = create_writer(parameters)
+        assert writer.active()
+        writer.close()
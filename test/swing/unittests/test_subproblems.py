@@ -0,0 +1,168 @@
+"""Tests for the subproblems in cbc.swing.subproblems, compared with
+the original implementations"""
+
+__author__ = "Kristoffer Selim and Anders Logg"
+__copyright__ = "Copyright (C) 2012 Simula Research Laboratory and %s" % __author__
+__license__  = "GNU GPL Version 3 or any later version"
+
+import numpy as np
+from dolfin import *
+from cbc.swing.subproblems import FluidProblem, StructureProblem, MeshProblem
+
+class SolverStub(object):
+    "Flow solver recording requests for reassembly"
+    def __init__(self):
+        self.reassembled = False
+    def reassemble(self, lazy=False):
+        self.reassembled = True
+
+class MovingFluid(FluidProblem):
+    "Fluid problem with only the data needed for moving the mesh"
+    def __init__(self, mesh):
+        self.Omega_F = mesh
+        self.omega_F0 = Mesh(mesh)
+        self.omega_F1 = Mesh(mesh)
+        self.w = Function(VectorFunctionSpace(mesh, "CG", 1))
+        self.solver = SolverStub()
+
+class InterfaceStub(object):
+    "FSI problem with a marked interface and identical meshes"
+    def __init__(self, mesh):
+        self.fsi_boundary_F = FacetFunction("uint", mesh)
+        self.fsi_boundary_F.set_all(0)
+        AutoSubDomain(lambda x: near(x[0], 1.0)).mark(self.fsi_boundary_F, 2)
+    def add_f2s(self, xs, xf):
+        xs.axpy(1.0, xf)
+
+class TractionStructure(StructureProblem):
+    "Structure problem with only the data needed for the stress transfer"
+    def __init__(self, mesh):
+        self.problem = InterfaceStub(mesh)
+        V = VectorFunctionSpace(mesh, "CG", 1)
+        self.test_F = TestFunction(V)
+        self.trial_F = TrialFunction(V)
+        self.G_F = Function(V)
+        self.G_S = Function(V)
+        self.N_F = FacetNormal(mesh)
+        self.G_0 = Constant((0.5, 0.0))
+        self.A_F = None
+        self.B_F = None
+        self.projection_solver = None
+
+class ElasticMesh(object):
+    "FSI problem with only the data needed for the mesh problem"
+    def __init__(self, mesh):
+        self.mesh = mesh
+    def fluid_mesh(self):
+        return self.mesh
+    def mesh_mu(self):
+        return 1.0
+    def mesh_lmbda(self):
+        return 2.0
+    def mesh_alpha(self):
+        return 1.0
+    def mesh_right_hand_side(self):
+        return Expression(("x[0]", "x[1]*x[1]"))
+
+class TestMeshMotion(object):
+    """Compare the vectorized mesh motion with the original loop over
+    vertices and components"""
+    def setup_class(self):
+        np.random.seed(0)
+        self.mesh = UnitSquare(4, 3)
+        self.dt = 0.1
+
+    def reference(self, X, x0, dofs):
+        "Loop over vertices (the original implementation)"
+        N, dim = X.shape
+        x1 = X.copy()
+        wx = np.zeros(dim*N)
+        for i in range(N):
+            for j in range(dim):
+                x1[i][j] = X[i][j] + dofs[j*N + i]
+        for i in range(N):
+            for j in range(dim):
+                wx[j*N + i] = (x1[i][j] - x0[i][j]) / self.dt
+        return x1, wx
+
+    def test_update_mesh_displacement(self):
+        """Moved coordinates and mesh velocity should match the loop"""
+        fluid = MovingFluid(self.mesh)
+        X = self.mesh.coordinates()
+        fluid.omega_F0.coordinates()[:] = X + 0.01*np.random.rand(*X.shape)
+        x0 = fluid.omega_F0.coordinates().copy()
+
+        U_M = Function(VectorFunctionSpace(self.mesh, "CG", 1))
+        U_M.vector()[:] = 0.01*np.random.rand(U_M.vector().size())
+        dofs = U_M.vector().array()
+        x1, wx = self.reference(X, x0, dofs)
+
+        fluid.update_mesh_displacement(U_M, self.dt, 0)
+        assert np.allclose(fluid.omega_F1.coordinates(), x1)
+        assert np.allclose(fluid.w.vector().array(), wx)
+        assert np.allclose(fluid.omega_F0.coordinates(), x0)
+        assert fluid.solver.reassembled
+
+class TestStressTransfer(object):
+    """Compare the transfer of fluid stress with the cached projection
+    with assembling and solving in each iteration"""
+    def setup_class(self):
+        self.mesh = UnitSquare(4, 4)
+
+    def reference(self, structure, Sigma_F):
+        "Assemble and solve (the original implementation)"
+        test_F, trial_F, N_F = structure.test_F, structure.trial_F, structure.N_F
+        markers = structure.problem.fsi_boundary_F
+        a_F = dot(test_F, trial_F)*ds(2)
+        L_F = - dot(test_F, dot(Sigma_F, N_F) + structure.G_0)*ds(2)
+        A_F = assemble(a_F, exterior_facet_domains=markers)
+        B_F = assemble(L_F, exterior_facet_domains=markers)
+        A_F.ident_zeros()
+        G_F = Vector()
+        solve(A_F, G_F, B_F)
+        return G_F.array()
+
+    def test_update_fluid_stress(self):
+        """The projected traction should match in repeated iterations"""
+        structure = TractionStructure(self.mesh)
+        solvers = []
+        for values in [((1.0, 2.0), (3.0, 4.0)), ((-2.0, 0.5), (0.5, 1.0))]:
+            Sigma_F = Constant(values)
+            structure.update_fluid_stress(Sigma_F)
+            solvers.append(structure.projection_solver)
+            G_F = self.reference(structure, Sigma_F)
+            assert np.allclose(structure.G_F.vector().array(), G_F)
+            assert np.allclose(structure.G_S.vector().array(), G_F)
+        assert solvers[0] is solvers[1]
+
+class TestMeshProblem(object):
+    """Compare the mesh problem with the cached factorizations with
+    assembling and solving in each step"""
+    def setup_class(self):
+        np.random.seed(0)
+        self.parameters = {"mesh_element_degree": 1,
+                           "structure_element_degree": 1}
+        self.problem = ElasticMesh(UnitSquare(4, 4))
+
+    def reference(self, mesh):
+        "Assemble and solve (the original implementation)"
+        A = assemble(mesh.a)
+        b = assemble(mesh.L)
+        mesh.bc.apply(A, b)
+        u1 = Vector()
+        solve(A, u1, b)
+        return u1.array()
+
+    def test_step(self):
+        """Iterations with new and repeated time steps should match"""
+        mesh = MeshProblem(self.problem, self.parameters)
+        mesh.u0.vector()[:] = np.random.rand(mesh.num_dofs)
+        n = mesh.displacement.vector().size()
+        for dt in [0.1, 0.1, 0.05, 0.1]:
+            for iteration in range(2):
+                mesh.displacement.vector()[:] = 0.1*np.random.rand(n)
+                mesh.step(dt)
+                u1 = self.reference(mesh)
+                assert np.allclose(mesh.u1.vector().array(), u1)
+            mesh.update(0.0)
+        assert sorted(mesh.solvers.keys()) == [0.05, 0.1]